@@ -0,0 +1,132 @@
+# admission.py
+import time
+import asyncio
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Optional
+
+
+class AdmissionQueueFullError(Exception):
+    """Слишком много запросов ждут своей очереди к GPT"""
+
+
+class FairLimiter:
+    """Глобальный лимит одновременных вызовов с честной очередью: пользователи обслуживаются по кругу"""
+
+    def __init__(self, max_concurrent: int, max_per_user: int = 0, max_queue: int = 0, window: int = 1000):
+        self.max_concurrent = max_concurrent
+        # 0 — без ограничения на пользователя (свободные слоты не простаивают)
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.active = 0
+        self.active_by_user: Counter = Counter()
+        # user -> очередь ожидающих; порядок ключей — порядок обхода по кругу
+        self._waiting: "OrderedDict[Any, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        self._waits: Deque[float] = deque(maxlen=window)
+        self.admitted = 0
+        self.rejected = 0
+
+    def _user_has_room(self, user_id: Any) -> bool:
+        return not self.max_per_user or self.active_by_user[user_id] < self.max_per_user
+
+    def _grant(self, user_id: Any) -> None:
+        self.active += 1
+        self.active_by_user[user_id] += 1
+        self.admitted += 1
+
+    def _can_admit_now(self, user_id: Any) -> bool:
+        """Свободный слот можно занять сразу, если его не ждёт никто, кому он положен по лимиту"""
+        if self.active >= self.max_concurrent or not self._user_has_room(user_id):
+            return False
+        # Ожидающие, упёршиеся в max_per_user, свободный слот занять не могут — их не ждём
+        return not any(self._user_has_room(waiting) for waiting in self._waiting)
+
+    async def acquire(self, user_id: Any) -> None:
+        if self._can_admit_now(user_id):
+            self._grant(user_id)
+            self._waits.append(0.0)
+            return
+        if self.max_queue and self._queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionQueueFullError("Слишком много запросов к GPT, попробуйте позже")
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        self._queued += 1
+        self._dispatch()
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но ожидающий ушёл — возвращаем слот
+                self.release(user_id)
+            else:
+                self._forget(user_id, future)
+            raise
+        self._waits.append(time.monotonic() - started)
+
+    def _forget(self, user_id: Any, future: asyncio.Future) -> None:
+        queue = self._waiting.get(user_id)
+        if queue and future in queue:
+            queue.remove(future)
+            self._queued -= 1
+            if not queue:
+                del self._waiting[user_id]
+
+    def release(self, user_id: Any) -> None:
+        self.active -= 1
+        self.active_by_user[user_id] -= 1
+        if self.active_by_user[user_id] <= 0:
+            del self.active_by_user[user_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Раздаёт освободившиеся слоты по кругу между пользователями с ожидающими запросами"""
+        while self.active < self.max_concurrent and self._waiting:
+            for user_id in list(self._waiting):
+                if self._user_has_room(user_id):
+                    break
+            else:
+                return
+            queue = self._waiting.pop(user_id)
+            future = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # Пользователь уходит в конец круга
+                self._waiting[user_id] = queue
+            self._grant(user_id)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[Any]) -> AsyncIterator[None]:
+        user_id = user_id if user_id is not None else "anonymous"
+        await self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else 0.0
+
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_per_user": self.max_per_user,
+            "active": self.active,
+            "queue_depth": self._queued,
+            "waiting_users": len(self._waiting),
+            "queue_by_user": {str(u): len(q) for u, q in self._waiting.items()},
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds": {
+                "avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(waits[-1], 3) if waits else 0.0,
+            },
+        }
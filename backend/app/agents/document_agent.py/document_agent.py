@@ -2,6 +2,8 @@
 import sys
 import os
 import json
+import time
+import asyncio
 
 # 👈 Добавляем путь к backend
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -30,11 +32,8 @@ class DocumentAgent:
         except Exception as e:
             return f"[OCR не доступен: {str(e)}]"
     
-    def analyze_document(self, text: str) -> AnalysisResult:
-        """Анализирует документ в 3 шага"""
-        
-        # Шаг 1: Извлечение данных
-        extract_prompt = f"""
+    def _extract_prompt(self, text: str) -> str:
+        return f"""
 Проанализируй этот документ и извлеки данные в JSON формате:
 
 {text[:3000]}
@@ -50,17 +49,43 @@ class DocumentAgent:
     "penalties": "описание штрафов" или null
 }}
 """
-        
-        extract_response = self.gpt.call_gpt(extract_prompt, max_tokens=800)
-        
-        # Парсим JSON
+    
+    def _risk_prompt(self, extracted_data: dict) -> str:
+        return f"""
+Проанализируй договор на риски. Верни JSON список:
+
+{json.dumps(extracted_data, ensure_ascii=False)}
+
+Формат:
+[
+    {{"level": "high|medium|low", "category": "financial", "description": "...", "suggestion": "..."}}
+]
+"""
+    
+    def _action_prompt(self, extracted_data: dict) -> str:
+        return f"""
+Создай чек-лист действий по этому документу (3-5 пунктов):
+
+{json.dumps(extracted_data, ensure_ascii=False)}
+
+Верни JSON: {{"action_items": ["действие 1", "действие 2"]}}
+"""
+    
+    def _summary_prompt(self, extracted_data: dict) -> str:
+        return f"""
+Краткое резюме документа (2-3 предложения):
+
+{json.dumps(extracted_data, ensure_ascii=False)}
+"""
+    
+    def _parse_extracted(self, extract_response: str) -> dict:
         try:
             start = extract_response.find('{')
             end = extract_response.rfind('}') + 1
             json_str = extract_response[start:end]
-            extracted_data = json.loads(json_str)
+            return json.loads(json_str)
         except:
-            extracted_data = {
+            return {
                 "document_type": "other",
                 "parties": [],
                 "total_amount": None,
@@ -69,58 +94,27 @@ class DocumentAgent:
                 "obligations": [],
                 "penalties": None
             }
-        
-        # Шаг 2: Анализ рисков
-        risk_prompt = f"""
-Проанализируй договор на риски. Верни JSON список:
-
-{json.dumps(extracted_data, ensure_ascii=False)}
-
-Формат:
-[
-    {{"level": "high|medium|low", "category": "financial", "description": "...", "suggestion": "..."}}
-]
-"""
-        
-        risk_response = self.gpt.call_gpt(risk_prompt, max_tokens=600)
-        
+    
+    def _parse_risks(self, risk_response: str) -> list:
         try:
             start = risk_response.find('[')
             end = risk_response.rfind(']') + 1
-            risk_flags = json.loads(risk_response[start:end])
+            return json.loads(risk_response[start:end])
         except:
-            risk_flags = []
-        
-        # Шаг 3: Чек-лист действий
-        action_prompt = f"""
-Создай чек-лист действий по этому документу (3-5 пунктов):
-
-{json.dumps(extracted_data, ensure_ascii=False)}
-
-Верни JSON: {{"action_items": ["действие 1", "действие 2"]}}
-"""
-        
-        action_response = self.gpt.call_gpt(action_prompt, max_tokens=400)
-        
+            return []
+    
+    def _parse_actions(self, action_response: str) -> list:
         try:
             start = action_response.find('{')
             end = action_response.rfind('}') + 1
             action_data = json.loads(action_response[start:end])
-            action_items = action_data.get("action_items", [])
+            return action_data.get("action_items", [])
         except:
-            action_items = ["Проверить документ вручную"]
-        
-        # Шаг 4: Резюме
-        summary_prompt = f"""
-Краткое резюме документа (2-3 предложения):
-
-{json.dumps(extracted_data, ensure_ascii=False)}
-"""
-        
-        summary = self.gpt.call_gpt(summary_prompt, max_tokens=200)
-        
-        # Собираем результат
-        result = AnalysisResult(
+            return ["Проверить документ вручную"]
+    
+    def _build_result(self, extracted_data: dict, risk_flags: list, action_items: list,
+                      summary: str, stage_timings: dict) -> AnalysisResult:
+        return AnalysisResult(
             extracted_data=ExtractedData(
                 document_type=DocumentType(extracted_data.get("document_type", "other")),
                 parties=extracted_data.get("parties", []),
@@ -141,10 +135,75 @@ class DocumentAgent:
             ],
             action_items=action_items,
             summary=summary,
-            confidence_score=0.85
+            confidence_score=0.85,
+            stage_timings=stage_timings
         )
+    
+    def analyze_document(self, text: str) -> AnalysisResult:
+        """Анализирует документ в 4 последовательных шага"""
+        timings = {}
+        
+        # Шаг 1: Извлечение данных
+        started = time.perf_counter()
+        extracted_data = self._parse_extracted(
+            self.gpt.call_gpt(self._extract_prompt(text), max_tokens=800)
+        )
+        timings["extract"] = round(time.perf_counter() - started, 3)
+        
+        # Шаг 2: Анализ рисков
+        started = time.perf_counter()
+        risk_flags = self._parse_risks(
+            self.gpt.call_gpt(self._risk_prompt(extracted_data), max_tokens=600)
+        )
+        timings["risks"] = round(time.perf_counter() - started, 3)
+        
+        # Шаг 3: Чек-лист действий
+        started = time.perf_counter()
+        action_items = self._parse_actions(
+            self.gpt.call_gpt(self._action_prompt(extracted_data), max_tokens=400)
+        )
+        timings["actions"] = round(time.perf_counter() - started, 3)
         
-        return result
+        # Шаг 4: Резюме
+        started = time.perf_counter()
+        summary = self.gpt.call_gpt(self._summary_prompt(extracted_data), max_tokens=200)
+        timings["summary"] = round(time.perf_counter() - started, 3)
+        
+        timings["total"] = round(sum(timings.values()), 3)
+        return self._build_result(extracted_data, risk_flags, action_items, summary, timings)
+    
+    async def analyze_document_pipeline(self, text: str) -> AnalysisResult:
+        """Конвейерный режим: после извлечения данных шаги 2-4 идут параллельно"""
+        timings = {}
+        pipeline_started = time.perf_counter()
+        
+        async def timed(stage: str, prompt: str, max_tokens: int) -> str:
+            started = time.perf_counter()
+            try:
+                return await self.gpt.acall_gpt(prompt, max_tokens=max_tokens)
+            finally:
+                timings[stage] = round(time.perf_counter() - started, 3)
+        
+        # Шаг 1: Извлечение данных (от него зависят остальные шаги)
+        extracted_data = self._parse_extracted(
+            await timed("extract", self._extract_prompt(text), 800)
+        )
+        
+        # Шаги 2-4: риски, чек-лист и резюме зависят только от extracted_data
+        risk_response, action_response, summary = await asyncio.gather(
+            timed("risks", self._risk_prompt(extracted_data), 600),
+            timed("actions", self._action_prompt(extracted_data), 400),
+            timed("summary", self._summary_prompt(extracted_data), 200),
+        )
+        
+        timings["total"] = round(time.perf_counter() - pipeline_started, 3)
+        return self._build_result(
+            extracted_data,
+            self._parse_risks(risk_response),
+            self._parse_actions(action_response),
+            summary,
+            timings
+        )
 
 # Глобальный экземпляр
 document_agent = DocumentAgent()
\ No newline at end of file
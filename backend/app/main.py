@@ -30,6 +30,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    # IAM-токен заранее и фоновое обновление до истечения
+    await document_agent.gpt.tokens.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await document_agent.gpt.tokens.stop()
+
 @app.get("/")
 async def root():
     return {"message": "DocuBot API работает!", "version": "0.1.0"}
@@ -50,7 +59,7 @@ async def analyze_document(file: UploadFile = File(...)):
         if not text or len(text) < 10:
             raise HTTPException(400, "Не удалось извлечь текст из документа")
         
-        result = document_agent.analyze_document(text)
+        result = await document_agent.analyze_document_pipeline(text)
         logger.info(f"Анализ завершён: {result.extracted_data.document_type}")
         
         return DocumentUploadResponse(status="success", result=result)
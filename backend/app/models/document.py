@@ -36,6 +36,7 @@ class AnalysisResult(BaseModel):
     action_items: List[str] = Field(default_factory=list)
     summary: str
     confidence_score: float = Field(ge=0, le=1)
+    stage_timings: Dict[str, float] = Field(default_factory=dict, description="Время этапов анализа, сек")
 
 class DocumentUploadResponse(BaseModel):
     status: str
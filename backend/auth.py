@@ -5,12 +5,13 @@ from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr
 
 # 🔧 Импортируем User и get_db из database.py (не определяем User заново!)
-from database import get_db, User
+from database import get_async_db, User
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key-change-this-in-production-2026")
 ALGORITHM = "HS256"
@@ -60,26 +61,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_user(db: Session, email: str):
-    return db.query(User).filter(User.email == email).first()
+async def get_user(db: AsyncSession, email: str):
+    return (await db.execute(select(User).where(User.email == email))).scalars().first()
 
-def get_user_by_id(db: Session, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+async def get_user_by_id(db: AsyncSession, user_id: int):
+    return await db.get(User, user_id)
 
-def create_user(db: Session, user: UserCreate) -> User:
+async def create_user(db: AsyncSession, user: UserCreate) -> User:
     db_user = User(
         email=user.email,
         hashed_password=get_password_hash(user.password),
         full_name=user.full_name
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -94,7 +95,10 @@ async def get_current_user(
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user = get_user_by_id(db, user_id)
+    user = await get_user_by_id(db, user_id)
+    # Завершаем читающую транзакцию: соединение возвращается в пул и не держится,
+    # пока эндпоинт ждёт извлечения текста и GPT (expire_on_commit=False — user остаётся загруженным)
+    await db.commit()
     if user is None or not user.is_active:
         raise credentials_exception
     return user
\ No newline at end of file
@@ -0,0 +1,274 @@
+# benchmarks/run.py
+"""Микробенчмарки горячих путей бэкенда (офлайн, без обращений к GPT и без БД)
+
+Запуск из папки backend:
+    python benchmarks/run.py                      # замер, сравнение с benchmarks/baseline.json
+    python benchmarks/run.py --save-baseline      # сохранить текущие результаты как базовые
+    python benchmarks/run.py --corpus ~/pdfs --output results.json --threshold 0.15
+
+Корпус — PDF-файлы в benchmarks/corpus/ (или --corpus); если их нет, генерируются образцы разного размера.
+Код возврата 1 — если медиана какого-либо замера хуже базовой больше чем на threshold.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import atexit
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(BACKEND_DIR, "benchmarks")
+sys.path.insert(0, BACKEND_DIR)
+
+# Ответ модели в том виде, в каком он обычно приходит: JSON в markdown-блоке
+SAMPLE_RESPONSE = """```json
+{
+  "extracted_data": {
+    "document_type": "contract",
+    "parties": [
+      {"name": "ООО «Ромашка»", "role": "заказчик", "inn": "7701234567", "address": "г. Москва, ул. Ленина, д. 1"},
+      {"name": "ИП Иванов И.И.", "role": "исполнитель", "inn": "770987654321"}
+    ],
+    "financial_terms": {"total_amount": 1250000, "currency": "RUB", "payment_terms": "50% предоплата, остаток в течение 10 дней", "penalties": "0,1% за день просрочки"},
+    "dates": {"contract_date": "2024-01-15", "start_date": "2024-02-01", "end_date": "2024-06-30", "deadline": "2024-06-30"},
+    "obligations": ["Исполнитель разрабатывает ПО", "Заказчик оплачивает работы", "Стороны подписывают акт"],
+    "missing_requisites": ["КПП заказчика"]
+  },
+  "risk_flags": [
+    {"level": "high", "category": "legal", "description": "Не определён порядок приёмки работ", "suggestion": "Добавить сроки и порядок подписания акта"},
+    {"level": "medium", "category": "financial", "description": "Предоплата без обеспечения", "suggestion": "Запросить банковскую гарантию"},
+    {"level": "low", "category": "operational", "description": "Нет контактных лиц", "suggestion": "Указать ответственных"}
+  ],
+  "action_items": [
+    {"action": "Согласовать порядок приёмки", "deadline": "2024-01-25", "responsible": "юрист"},
+    {"action": "Запросить КПП заказчика", "deadline": null, "responsible": "менеджер"}
+  ],
+  "summary": "Договор на разработку ПО на 1 250 000 руб. Основные риски — приёмка работ и предоплата без обеспечения.",
+  "confidence_score": 0.87
+}
+```"""
+
+CLAUSE = (
+    "{n}. Исполнитель обязуется выполнить работы по разработке программного обеспечения в соответствии "
+    "с техническим заданием, а Заказчик обязуется принять и оплатить результат работ в размере {amount} рублей. "
+    "Оплата производится в течение 10 банковских дней с момента подписания акта сдачи-приёмки."
+)
+
+
+def generate_corpus(directory: str) -> List[str]:
+    """Образцы договоров: 1, 5 и 30 страниц"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    font = "Helvetica"
+    font_path = os.path.join(BACKEND_DIR, "fonts", "DejaVuSans.ttf")
+    if os.path.exists(font_path):
+        pdfmetrics.registerFont(TTFont("BenchFont", font_path))
+        font = "BenchFont"
+
+    paths = []
+    for name, pages in (("small", 1), ("medium", 5), ("large", 30)):
+        path = os.path.join(directory, f"sample_{name}.pdf")
+        c = canvas.Canvas(path, pagesize=A4)
+        n = 1
+        for page in range(pages):
+            c.setFont(font, 9)
+            c.drawString(50, 810, "ДОГОВОР ПОДРЯДА № 15/24 — ООО «Ромашка»")
+            y = 780
+            while y > 60:
+                text = CLAUSE.format(n=n, amount=n * 10000)
+                for start in range(0, len(text), 110):
+                    c.drawString(50, y, text[start:start + 110])
+                    y -= 12
+                n += 1
+                y -= 6
+            c.drawString(280, 30, f"Страница {page + 1} из {pages}")
+            c.showPage()
+        c.save()
+        paths.append(path)
+    return paths
+
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float) -> Dict[str, float]:
+    """Как timeit: число вызовов в серии подбирается так, чтобы серия длилась не меньше min_time"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number)
+    samples.sort()
+    median = statistics.median(samples)
+    return {
+        "loops": number,
+        "repeat": repeat,
+        "median_ms": round(median * 1000, 4),
+        "mean_ms": round(statistics.mean(samples) * 1000, 4),
+        "min_ms": round(samples[0] * 1000, 4),
+        "stdev_ms": round(statistics.pstdev(samples) * 1000, 4),
+        "ops_per_s": round(1 / median, 1) if median else 0.0,
+    }
+
+
+def load_backend():
+    """Импорт main_simple без внешних зависимостей: временный ключ и отдельная БД во временной папке"""
+    workdir = tempfile.mkdtemp(prefix="docubot-bench-")
+    atexit.register(shutil.rmtree, workdir, True)
+    if not os.getenv("AUTHORIZED_KEY_CONTENT"):
+        from loadtest.fake_yandex import write_key
+
+        key_path = os.path.join(workdir, "key.json")
+        write_key(key_path)
+        with open(key_path, encoding="utf-8") as f:
+            os.environ["AUTHORIZED_KEY_CONTENT"] = f.read()
+    os.environ.setdefault("PERSISTENT_CACHE_ENABLED", "0")
+    # SQLite-файл создаётся в текущей папке — не трогаем рабочую БД
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main_simple
+    finally:
+        os.chdir(cwd)
+    return main_simple
+
+
+def run_benchmarks(corpus: List[str], repeat: int, min_time: float, only: Optional[List[str]]) -> Dict[str, dict]:
+    import logging
+
+    import main_simple as m
+    from pdf_extract import extract_pdf_text
+
+    # Логи отчёта о шрифтах и т.п. искажают замеры
+    logging.disable(logging.CRITICAL)
+    agent = m.agent
+    results: Dict[str, dict] = {}
+
+    def bench(name: str, fn: Callable[[], object]) -> None:
+        if only and not any(part in name for part in only):
+            return
+        results[name] = measure(fn, repeat, min_time)
+        print(f"  {name:<40} {results[name]['median_ms']:>12.4f} ms", file=sys.stderr)
+
+    texts = {}
+    for path in corpus:
+        label = os.path.splitext(os.path.basename(path))[0]
+        bench(f"extract_text[{label}]", lambda path=path: extract_pdf_text(path, m.PDF_MAX_PAGES, m.PDF_MAX_CHARS))
+        raw = extract_pdf_text(path, m.PDF_MAX_PAGES, m.PDF_MAX_CHARS)
+        bench(f"compact_text[{label}]", lambda raw=raw: m.compact_text(raw))
+        texts[label] = m.compact_text(raw).text
+
+    for label, text in texts.items():
+        bench(f"get_text_hash[{label}]", lambda text=text: m.get_text_hash(text))
+        bench(f"build_prompt[{label}]", lambda text=text: agent.build_prompt(text))
+
+    data = agent._parse_json(SAMPLE_RESPONSE)
+    result = agent.assemble_result(data)
+    full_result = json.loads(json.dumps(result.model_dump()))
+    bench("parse_json", lambda: agent._parse_json(SAMPLE_RESPONSE))
+    bench("assemble_result", lambda: agent.assemble_result(data))
+    bench("parse_response", lambda: agent.parse_response(SAMPLE_RESPONSE))
+    bench("persist_json_dumps", lambda: json.dumps(result.model_dump()))
+    bench("persist_dump_json", lambda: m._RESULT_ADAPTER.dump_json(result))
+    bench("render_report_pdf", lambda: m.render_report_pdf(full_result))
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """Печатает сравнение медиан с базовыми и возвращает список регрессий"""
+    regressions = []
+    print(f"\n{'benchmark':<40}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<40}{'—':>14}{current['median_ms']:>14.4f}{'new':>10}")
+            continue
+        change = current["median_ms"] / base["median_ms"] - 1 if base["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  ❌"
+        elif change < -threshold:
+            flag = "  ✅"
+        print(f"{name:<40}{base['median_ms']:>14.4f}{current['median_ms']:>14.4f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Микробенчмарки DocuBot")
+    parser.add_argument("--corpus", default=os.path.join(BENCH_DIR, "corpus"), help="папка с PDF-файлами")
+    parser.add_argument("--baseline", default=os.path.join(BENCH_DIR, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="записать результаты в --baseline")
+    parser.add_argument("--output", help="записать результаты в JSON")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="минимальная длительность серии, с")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление медианы (0.2 = 20%%)")
+    parser.add_argument("--only", help="только замеры, в имени которых есть одна из подстрок (через запятую)")
+    return parser.parse_args()
+
+
+def main() -> int:
+    args = parse_args()
+    load_backend()
+
+    corpus = sorted(glob.glob(os.path.join(args.corpus, "*.pdf")))
+    if not corpus:
+        corpus_dir = tempfile.mkdtemp(prefix="docubot-corpus-")
+        atexit.register(shutil.rmtree, corpus_dir, True)
+        corpus = generate_corpus(corpus_dir)
+        print(f"ℹ️ В {args.corpus} нет PDF — используются сгенерированные образцы", file=sys.stderr)
+
+    only = [s.strip() for s in args.only.split(",")] if args.only else None
+    results = run_benchmarks(corpus, args.repeat, args.min_time, only)
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": [os.path.basename(p) for p in corpus],
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Базовые результаты сохранены в {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️ Базовых результатов нет ({args.baseline}); сохраните их флагом --save-baseline", file=sys.stderr)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n❌ Регрессии: {', '.join(regressions)}")
+        return 1
+    print("\n✅ Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
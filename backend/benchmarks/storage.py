@@ -0,0 +1,144 @@
+# benchmarks/storage.py
+"""Хранение AnalysisHistory: старый текстовый full_result против сжатого full_result_blob
+
+Запуск из папки backend:
+    python benchmarks/storage.py --rows 5000 --output storage.json
+Сравнивает размер данных и файла БД, чтение одного результата (как generate_pdf) и выборку истории.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import statistics
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, desc
+from sqlalchemy.orm import Session, undefer_group
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from run import SAMPLE_RESPONSE, load_backend  # noqa: E402
+
+
+def timed(fn: Callable[[], object], n: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "n": n,
+        "median_ms": round(statistics.median(samples) * 1000, 4),
+        "p95_ms": round(samples[int(0.95 * (n - 1))] * 1000, 4),
+    }
+
+
+def sample_results(m, rows: int) -> List:
+    """Результаты с разными сторонами, суммами и текстами — чтобы сжатие не было нереалистично хорошим"""
+    rng = random.Random(42)
+    base = m.agent._parse_json(SAMPLE_RESPONSE)
+    words = base["summary"].split() + [f["description"] for f in base["risk_flags"]]
+    results = []
+    for _ in range(rows):
+        data = json.loads(json.dumps(base))
+        data["extracted_data"]["parties"][0]["name"] = f"ООО «Компания {rng.randint(1, 10**6)}»"
+        data["extracted_data"]["financial_terms"]["total_amount"] = rng.randint(10**4, 10**8)
+        data["summary"] = " ".join(rng.choice(words) for _ in range(rng.randint(20, 60)))
+        rng.shuffle(data["risk_flags"])
+        results.append(m.agent.assemble_result(data))
+    return results
+
+
+def build_db(m, path: str, results: List, packed: bool):
+    from database import Base
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for i, result in enumerate(results):
+            entry = m.history_entry(f"doc_{i}.pdf", result, None)
+            if not packed:
+                # Формат до сжатия: текст json.dumps с \\u-экранированной кириллицей
+                entry.full_result_blob = None
+                entry.full_result = json.dumps(result.model_dump())
+            db.add(entry)
+        db.commit()
+    return engine
+
+
+def measure_db(m, engine, path: str, reads: int, legacy: bool) -> dict:
+    from database import AnalysisHistory
+
+    with Session(engine) as db:
+        column = AnalysisHistory.full_result if legacy else AnalysisHistory.full_result_blob
+        payloads = [v for (v,) in db.query(column).all()]
+        ids = [i for (i,) in db.query(AnalysisHistory.id).all()]
+    payload_bytes = [len(p.encode("utf-8") if isinstance(p, str) else p) for p in payloads]
+
+    rng = random.Random(1)
+
+    def read_one():
+        # Путь generate_pdf: строка по id и разбор полного результата
+        with Session(engine) as db:
+            row = db.get(AnalysisHistory, rng.choice(ids))
+            return row.result_data
+
+    def history_page():
+        # До изменения история грузила строки целиком, вместе с full_result
+        with Session(engine) as db:
+            query = db.query(AnalysisHistory)
+            if legacy:
+                query = query.options(undefer_group("full_result"))
+            return query.order_by(desc(AnalysisHistory.created_at)).limit(50).all()
+
+    return {
+        "file_bytes": os.path.getsize(path),
+        "payload_bytes_total": sum(payload_bytes),
+        "payload_bytes_avg": round(statistics.mean(payload_bytes)),
+        "read_result": timed(read_one, reads),
+        "history_page_50": timed(history_page, max(10, reads // 10)),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк хранения full_result")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--output", help="записать результаты в JSON")
+    args = parser.parse_args()
+
+    m = load_backend()
+    logging.disable(logging.CRITICAL)
+
+    results = sample_results(m, args.rows)
+    workdir = tempfile.mkdtemp(prefix="docubot-storage-")
+    try:
+        report = {}
+        for name, packed in (("legacy_text", False), ("compressed_blob", True)):
+            path = os.path.join(workdir, f"{name}.db")
+            engine = build_db(m, path, results, packed)
+            report[name] = measure_db(m, engine, path, args.reads, legacy=not packed)
+            engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    legacy, packed = report["legacy_text"], report["compressed_blob"]
+    print(f"{'':<24}{'legacy_text':>16}{'compressed_blob':>18}")
+    for label, key in (("avg payload, bytes", "payload_bytes_avg"), ("db file, bytes", "file_bytes")):
+        print(f"{label:<24}{legacy[key]:>16}{packed[key]:>18}")
+    for label, key in (("read result p50, ms", "read_result"), ("history page p50, ms", "history_page_50")):
+        print(f"{label:<24}{legacy[key]['median_ms']:>16}{packed[key]['median_ms']:>18}")
+    report["rows"] = args.rows
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# chunking.py
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Начало пункта договора: "1.", "2.3.", "10.1.2", "Статья 5", "Раздел II", "ПРИЛОЖЕНИЕ"
+CLAUSE_START = re.compile(
+    r"^\s*(?:\d+(?:\.\d+)*\.?\s|(?:статья|раздел|глава|приложение)\b)",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+RISK_ORDER = {"critical": 0, "high": 1, "medium": 2, "low": 3}
+
+
+def _split_long(segment: str, max_chars: int) -> List[str]:
+    """Режет слишком длинный пункт по абзацам, предложениям и, в крайнем случае, по пробелам"""
+    parts = []
+    while len(segment) > max_chars:
+        window = segment[:max_chars]
+        cut = max(window.rfind("\n\n"), window.rfind(". "), window.rfind("\n"))
+        if cut < max_chars // 2:
+            cut = window.rfind(" ")
+        # Разрыв включаем в текущую часть; без разрыва режем ровно по max_chars
+        end = cut + 1 if cut > 0 else max_chars
+        parts.append(segment[:end])
+        segment = segment[end:]
+    if segment.strip():
+        parts.append(segment)
+    return parts
+
+
+def split_into_chunks(text: str, max_chars: int) -> List[str]:
+    """Делит текст на фрагменты не длиннее max_chars по границам пунктов"""
+    if len(text) <= max_chars:
+        return [text]
+
+    starts = [m.start() for m in CLAUSE_START.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    segments = [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+    chunks: List[str] = []
+    current = ""
+    for segment in segments:
+        for piece in _split_long(segment, max_chars):
+            if current and len(current) + len(piece) > max_chars:
+                chunks.append(current)
+                current = ""
+            current += piece
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def _key(value) -> str:
+    return re.sub(r"\W+", " ", str(value or "")).strip().lower()
+
+
+def _first(values) -> Optional[object]:
+    for value in values:
+        if value not in (None, "", [], {}):
+            return value
+    return None
+
+
+def _unique(items, key) -> list:
+    seen = set()
+    result = []
+    for item in items:
+        k = key(item)
+        if k and k not in seen:
+            seen.add(k)
+            result.append(item)
+    return result
+
+
+def merge_chunk_analyses(parts: List[Dict]) -> Dict:
+    """Объединяет JSON-ответы модели по фрагментам в один ответ того же формата"""
+    if len(parts) == 1:
+        return parts[0]
+
+    extracted = [p.get("extracted_data") or {} for p in parts]
+
+    # Тип документа: самый частый осмысленный, иначе other
+    types = Counter(e.get("document_type") for e in extracted if e.get("document_type") not in (None, "other"))
+    document_type = types.most_common(1)[0][0] if types else "other"
+
+    # Стороны: без дублей по названию, недостающие реквизиты дополняются из других фрагментов
+    parties: Dict[str, dict] = {}
+    for e in extracted:
+        for party in e.get("parties") or []:
+            if not isinstance(party, dict):
+                party = {"name": str(party)}
+            k = _key(party.get("name"))
+            if not k:
+                continue
+            if k in parties:
+                for field, value in party.items():
+                    if parties[k].get(field) in (None, "", "other"):
+                        parties[k][field] = value
+            else:
+                parties[k] = dict(party)
+
+    def merged_dict(field: str) -> dict:
+        dicts = [e.get(field) or {} for e in extracted]
+        keys = []
+        for d in dicts:
+            keys.extend(k for k in d if k not in keys)
+        return {k: _first(d.get(k) for d in dicts) for k in keys}
+
+    # Отсутствующий реквизит — только если его не нашли ни в одном фрагменте
+    missing_sets = [{_key(m): m for m in (e.get("missing_requisites") or [])} for e in extracted]
+    common_missing = set.intersection(*(set(m) for m in missing_sets)) if missing_sets else set()
+    missing = [m for k, m in missing_sets[0].items() if k in common_missing] if missing_sets else []
+
+    risk_flags = _unique(
+        [f for p in parts for f in (p.get("risk_flags") or []) if isinstance(f, dict)],
+        key=lambda f: _key(f.get("title") or f.get("description")),
+    )
+    risk_flags.sort(key=lambda f: RISK_ORDER.get(str(f.get("level", "low")).lower(), 3))
+
+    action_items = _unique(
+        [a for p in parts for a in (p.get("action_items") or [])],
+        key=lambda a: _key(a.get("action") if isinstance(a, dict) else a),
+    )
+
+    summaries = _unique([p.get("summary") for p in parts if p.get("summary")], key=_key)
+    notes = _unique([p.get("analysis_notes") for p in parts if p.get("analysis_notes")], key=_key)
+    scores = [p["confidence_score"] for p in parts if isinstance(p.get("confidence_score"), (int, float))]
+
+    return {
+        "extracted_data": {
+            "document_type": document_type,
+            "document_subtype": _first(e.get("document_subtype") for e in extracted if e.get("document_subtype") != "other") or "other",
+            "document_number": _first(e.get("document_number") for e in extracted),
+            "document_date": _first(e.get("document_date") for e in extracted),
+            "parties": list(parties.values()),
+            "financial_terms": merged_dict("financial_terms"),
+            "dates": merged_dict("dates"),
+            "obligations": _unique([o for e in extracted for o in (e.get("obligations") or [])], key=_key),
+            "penalties": _first(e.get("penalties") for e in extracted),
+            "termination_conditions": _first(e.get("termination_conditions") for e in extracted),
+            "dispute_resolution": _first(e.get("dispute_resolution") for e in extracted),
+            "missing_requisites": missing,
+        },
+        "risk_flags": risk_flags,
+        "action_items": action_items,
+        "summary": " ".join(summaries),
+        "confidence_score": sum(scores) / len(scores) if scores else 0.5,
+        "analysis_notes": "\n".join(notes) or None,
+    }
@@ -1,7 +1,14 @@
 # database.py
 import os
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean  # ✅ Добавлен Boolean
-from sqlalchemy.orm import sessionmaker, declarative_base
+import json
+import zlib
+from typing import Iterable, Optional
+from sqlalchemy import create_engine, case, func, select, Column, ForeignKey, Index, Integer, String, Float, DateTime, Text, Boolean, LargeBinary  # ✅ Добавлен Boolean
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, declarative_base, deferred
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
 
 # 🎯 Используем SQLite локально, PostgreSQL на Railway
@@ -11,9 +18,50 @@ if DATABASE_URL and "railway" in DATABASE_URL:
 else:
     engine = create_engine("sqlite:///./docubot_local.db", connect_args={"check_same_thread": False})
 
+# Синхронный движок — для миграций и скриптов; эндпоинты работают через async_engine
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# ==================== ASYNC ДВИЖОК ====================
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Railway/прокси закрывают простаивающие соединения — переоткрываем заранее
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# 0 — если база за pgbouncer в режиме transaction (подготовленные выражения там не живут)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+def _create_async_engine():
+    if engine.dialect.name == "postgresql":
+        url = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+        # asyncpg не понимает sslmode из URL — SSL задаётся через connect_args
+        url = url.difference_update_query(["sslmode"]).update_query_dict(
+            {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+        )
+        return create_async_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args={"ssl": "require", "statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+        )
+    # SQLite-файл: соединения дешёвые, у aiosqlite по умолчанию пул не держится (NullPool)
+    return create_async_engine("sqlite+aiosqlite:///./docubot_local.db")
+
+async_engine = _create_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Полный результат анализа хранится как JSON, сжатый zlib (в разы меньше текстового json.dumps)
+RESULT_COMPRESSION_LEVEL = 6
+
+def pack_result(payload: bytes) -> bytes:
+    return zlib.compress(payload, RESULT_COMPRESSION_LEVEL)
+
+def unpack_result(blob: bytes) -> bytes:
+    return zlib.decompress(blob)
+
 # ==================== МОДЕЛЬ AnalysisHistory ====================
 class AnalysisHistory(Base):
     __tablename__ = "analysis_history"
@@ -27,9 +75,72 @@ class AnalysisHistory(Base):
     summary = Column(Text, nullable=True)
     confidence_score = Column(Float, nullable=True)
     risk_count = Column(Integer, default=0)
-    full_result = Column(Text, nullable=True)
-    user_id = Column(String, default="web")
+    # Старый формат (текст json.dumps); новые записи пишутся в full_result_blob
+    full_result = deferred(Column(Text, nullable=True), group="full_result")
+    full_result_blob = deferred(Column(LargeBinary, nullable=True), group="full_result")
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # История и статистика пользователя: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+        Index("ix_analysis_history_user_created", "user_id", "created_at", "id"),
+    )
+    
+    @property
+    def result_json(self) -> Optional[bytes]:
+        """JSON полного результата независимо от формата хранения"""
+        if self.full_result_blob is not None:
+            return unpack_result(self.full_result_blob)
+        if self.full_result is not None:
+            return self.full_result.encode("utf-8")
+        return None
+    
+    @result_json.setter
+    def result_json(self, value) -> None:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        self.full_result_blob = pack_result(value) if value is not None else None
+        self.full_result = None
+    
+    @property
+    def result_data(self) -> dict:
+        payload = self.result_json
+        return json.loads(payload) if payload else {}
+
+# ==================== МОДЕЛЬ AnalysisCacheEntry ====================
+class AnalysisCacheEntry(Base):
+    """Персистентный кэш анализов: общий для всех воркеров и переживает деплой"""
+    __tablename__ = "analysis_cache"
+    
+    # sha256(content_hash + prompt_version + model_uri)
+    cache_key = Column(String(64), primary_key=True)
+    content_hash = Column(String(64), nullable=False, index=True)
+    prompt_version = Column(String, nullable=False)
+    model_uri = Column(String, nullable=False)
+    result = Column(Text, nullable=False)
+    hit_count = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # По нему удаляются давно не читавшиеся записи (PERSISTENT_CACHE_TTL_DAYS)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+# ==================== МОДЕЛЬ UserStats ====================
+class UserStats(Base):
+    """Счётчики для /api/stats: меняются в той же транзакции, что и записи analysis_history"""
+    __tablename__ = "user_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_documents = Column(Integer, nullable=False, default=0)
+    contracts = Column(Integer, nullable=False, default=0)
+    invoices = Column(Integer, nullable=False, default=0)
+    acts = Column(Integer, nullable=False, default=0)
+    # Среднее считается только по записям с confidence_score (как AVG в SQL)
+    confidence_sum = Column(Float, nullable=False, default=0.0)
+    confidence_count = Column(Integer, nullable=False, default=0)
+    total_risks = Column(Integer, nullable=False, default=0)
+    
+    @property
+    def avg_confidence(self) -> float:
+        return self.confidence_sum / self.confidence_count if self.confidence_count else 0.0
 
 # ==================== МОДЕЛЬ User ====================
 class User(Base):
@@ -43,6 +154,58 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 # ==================== ФУНКЦИИ ====================
+STATS_COUNTERS = ("total_documents", "contracts", "invoices", "acts", "confidence_sum", "confidence_count", "total_risks")
+
+def _is_type(document_type: str):
+    return func.coalesce(func.sum(case((AnalysisHistory.document_type == document_type, 1), else_=0)), 0)
+
+def user_stats_query():
+    """Счётчики UserStats, пересчитанные по analysis_history (GROUP BY user_id)"""
+    return select(
+        AnalysisHistory.user_id,
+        func.count(AnalysisHistory.id),
+        _is_type("contract"),
+        _is_type("invoice"),
+        _is_type("act"),
+        func.coalesce(func.sum(AnalysisHistory.confidence_score), 0.0),
+        func.count(AnalysisHistory.confidence_score),
+        func.coalesce(func.sum(AnalysisHistory.risk_count), 0),
+    ).where(AnalysisHistory.user_id.is_not(None)).group_by(AnalysisHistory.user_id)
+
+async def _upsert_stats(db: AsyncSession, user_id: int, values: dict, increment: bool) -> None:
+    """INSERT ... ON CONFLICT: атомарно и без гонки между воркерами за первую запись пользователя"""
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    stmt = insert(UserStats).values(user_id=user_id, **values)
+    if increment:
+        updates = {name: getattr(UserStats, name) + stmt.excluded[name] for name in values}
+    else:
+        updates = {name: stmt.excluded[name] for name in values}
+    await db.execute(stmt.on_conflict_do_update(index_elements=[UserStats.user_id], set_=updates))
+
+async def bump_user_stats(db: AsyncSession, user_id: Optional[int], entries: Iterable[AnalysisHistory]) -> None:
+    """Добавляет новые записи истории к счётчикам; коммит — вместе с самими записями"""
+    if user_id is None:
+        return
+    delta = dict.fromkeys(STATS_COUNTERS, 0)
+    for entry in entries:
+        delta["total_documents"] += 1
+        if entry.document_type in ("contract", "invoice", "act"):
+            delta[entry.document_type + "s"] += 1
+        if entry.confidence_score is not None:
+            delta["confidence_sum"] += entry.confidence_score
+            delta["confidence_count"] += 1
+        delta["total_risks"] += entry.risk_count or 0
+    if delta["total_documents"]:
+        await _upsert_stats(db, user_id, delta, increment=True)
+
+async def rebuild_user_stats(db: AsyncSession, user_id: int) -> UserStats:
+    """Пересчёт счётчиков пользователя по истории (нет строки в user_stats или она разошлась)"""
+    row = (await db.execute(user_stats_query().where(AnalysisHistory.user_id == user_id))).first()
+    values = dict(zip(STATS_COUNTERS, row[1:])) if row else dict.fromkeys(STATS_COUNTERS, 0)
+    await _upsert_stats(db, user_id, values, increment=False)
+    await db.commit()
+    return await db.get(UserStats, user_id, populate_existing=True)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -50,6 +213,12 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # Схема меняется только миграциями (migrations.py), create_all существующие таблицы не трогает
+    from migrations import run_migrations
+    run_migrations()
     print("✅ Database initialized")
\ No newline at end of file
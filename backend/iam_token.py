@@ -0,0 +1,173 @@
+# iam_token.py
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import jwt
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Адрес IAM можно переопределить (например, на локальную заглушку loadtest/fake_yandex.py)
+IAM_URL = os.getenv("YANDEX_IAM_URL", "https://iam.api.cloud.yandex.net/iam/v1/tokens")
+
+# Обновляем токен заранее, за столько секунд до истечения
+IAM_REFRESH_MARGIN = float(os.getenv("IAM_REFRESH_MARGIN", 600))
+IAM_TIMEOUT = float(os.getenv("IAM_TIMEOUT", 10))
+# Пауза перед повтором, если фоновое обновление не удалось
+IAM_RETRY_DELAY = 30
+
+
+def load_authorized_key(key_path: Optional[str] = None) -> dict:
+    """Авторизованный ключ сервисного аккаунта: переменная окружения, authorized_key.json или key_path"""
+    # 🔑 Читаем ключ из переменной окружения (приоритет для Railway)
+    key_content = os.getenv('AUTHORIZED_KEY_CONTENT')
+    if key_content:
+        logger.info("✅ Ключ загружен из переменной окружения")
+        return json.loads(key_content)
+    # 🔑 Читаем из файла authorized_key.json (локально)
+    if os.path.isfile('authorized_key.json'):
+        with open('authorized_key.json', 'r', encoding='utf-8') as f:
+            logger.info("✅ Ключ загружен из файла authorized_key.json")
+            return json.load(f)
+    # 🔑 Фолбэк: файл по пути (если указан)
+    if key_path and os.path.isfile(key_path):
+        with open(key_path, 'r', encoding='utf-8') as f:
+            logger.info(f"✅ Ключ загружен из файла {key_path}")
+            return json.load(f)
+    raise RuntimeError("❌ Не найден ключ Yandex GPT! Установите AUTHORIZED_KEY_CONTENT")
+
+
+def parse_expires_at(value: Optional[str], default: float) -> float:
+    """expiresAt из ответа IAM ("2024-01-01T12:00:00.123456789Z") -> unix time"""
+    if not value:
+        return default
+    try:
+        # Наносекунды обрезаем до микросекунд — fromisoformat их не принимает
+        value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        logger.warning(f"⚠️ Не удалось разобрать expiresAt: {value}")
+        return default
+
+
+class IAMTokenManager:
+    """Один IAM-токен на процесс: фоновое обновление до истечения и склейка одновременных обновлений"""
+
+    def __init__(self, key_data: dict, refresh_margin: float = IAM_REFRESH_MARGIN):
+        self.service_account_id = key_data['service_account_id']
+        self.private_key = key_data['private_key']
+        self.key_id = key_data['id']
+        self.refresh_margin = refresh_margin
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self.refreshes = 0
+        self._async_lock: Optional[asyncio.Lock] = None
+        self._sync_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _is_fresh(self) -> bool:
+        return self.token is not None and time.time() < self.expires_at - self.refresh_margin
+
+    def _sign_jwt(self) -> str:
+        now = int(time.time())
+        payload = {
+            'aud': IAM_URL,
+            'iss': self.service_account_id,
+            'iat': now,
+            'exp': now + 3600
+        }
+        headers = {'kid': self.key_id, 'alg': 'PS256', 'typ': 'JWT'}
+        return jwt.encode(payload, self.private_key, algorithm='PS256', headers=headers)
+
+    def _store(self, resp: httpx.Response) -> str:
+        if resp.status_code != 200:
+            raise Exception(f"Failed to get IAM token: {resp.text}")
+        data = resp.json()
+        self.token = data["iamToken"]
+        self.expires_at = parse_expires_at(data.get("expiresAt"), default=time.time() + 3600)
+        self.refreshes += 1
+        logger.info(f"🔑 IAM-токен обновлён, действует до {datetime.fromtimestamp(self.expires_at)}")
+        return self.token
+
+    async def get_token(self) -> str:
+        if self._is_fresh():
+            return self.token
+        return await self.refresh()
+
+    async def refresh(self, force: bool = False) -> str:
+        """Обновляет токен; одновременные вызовы ждут один и тот же запрос"""
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if not force and self._is_fresh():
+                return self.token
+            # PS256-подпись — CPU-работа, выносим из event loop
+            encoded = await asyncio.to_thread(self._sign_jwt)
+            async with httpx.AsyncClient(timeout=IAM_TIMEOUT) as client:
+                resp = await client.post(IAM_URL, json={"jwt": encoded})
+            return self._store(resp)
+
+    def get_token_sync(self) -> str:
+        """Для синхронного кода: тот же токен, блокирующее обновление только при необходимости"""
+        if self._is_fresh():
+            return self.token
+        with self._sync_lock:
+            if self._is_fresh():
+                return self.token
+            with httpx.Client(timeout=IAM_TIMEOUT) as client:
+                resp = client.post(IAM_URL, json={"jwt": self._sign_jwt()})
+            return self._store(resp)
+
+    async def start(self) -> None:
+        """Получает токен при старте и запускает фоновое обновление"""
+        if self._task is not None:
+            return
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"❌ Не удалось получить IAM-токен при старте: {e}")
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            delay = self.expires_at - self.refresh_margin - time.time()
+            if self.token is None:
+                delay = 0
+            await asyncio.sleep(max(delay, 1))
+            try:
+                await self.refresh(force=True)
+            except Exception as e:
+                logger.error(f"❌ Фоновое обновление IAM-токена: {e}")
+                await asyncio.sleep(IAM_RETRY_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            "has_token": self.token is not None,
+            "expires_in": round(self.expires_at - time.time()) if self.token else None,
+            "refreshes": self.refreshes,
+            "background_refresh": self._task is not None and not self._task.done(),
+        }
+
+
+# Общие менеджеры по ключу сервисного аккаунта (одни на процесс)
+_managers: Dict[Tuple[str, str], IAMTokenManager] = {}
+
+
+def get_token_manager(key_data: dict) -> IAMTokenManager:
+    key = (key_data['service_account_id'], key_data['id'])
+    if key not in _managers:
+        _managers[key] = IAMTokenManager(key_data)
+    return _managers[key]
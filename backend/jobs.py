@@ -0,0 +1,152 @@
+# jobs.py
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Терминальные статусы задачи
+FINISHED_STATUSES = ("done", "error")
+
+
+class JobQueueFullError(Exception):
+    """Очередь задач переполнена"""
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Форматирует одно событие Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Job:
+    def __init__(self, user_id: int, filename: str, payload: Any):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.filename = filename
+        # Входные данные для обработчика (например, загруженный файл); освобождаются после запуска
+        self.payload = payload
+        self.status = "queued"
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.events: List[dict] = []
+        self._changed = asyncio.Condition()
+
+    def emit(self, stage: str, data: Optional[dict] = None) -> None:
+        """Добавляет событие этапа и будит подписчиков SSE"""
+        self.events.append({"stage": stage, "at": round(time.time(), 3), **(data or {})})
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[dict]:
+        """Отдаёт все события задачи (прошлые и новые) до её завершения"""
+        sent = 0
+        while True:
+            async with self._changed:
+                while sent == len(self.events) and self.status not in FINISHED_STATUSES:
+                    await self._changed.wait()
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self.status in FINISHED_STATUSES:
+                return
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "events": self.events,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """Фоновые задачи анализа: ограниченная очередь и фиксированный пул воркеров в процессе"""
+
+    def __init__(
+        self,
+        handler: Callable[[Job], Awaitable[dict]],
+        workers: int = 4,
+        max_queue: int = 100,
+        ttl_seconds: float = 3600,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.ttl_seconds = ttl_seconds
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"✅ Запущено воркеров задач: {self.workers}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, user_id: int, filename: str, payload: Any) -> Job:
+        self._prune()
+        job = Job(user_id, filename, payload)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError("Очередь анализа переполнена, попробуйте позже")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        """Удаляет завершённые задачи старше TTL"""
+        deadline = time.time() - self.ttl_seconds
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < deadline:
+                del self._jobs[job_id]
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = "running"
+            try:
+                job.result = await self.handler(job)
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status = "error"
+                job.error = "Задача отменена"
+                raise
+            except Exception as e:
+                logger.error(f"❌ Задача {job.id} завершилась ошибкой: {e}")
+                job.status = "error"
+                job.error = str(e)
+            finally:
+                job.payload = None
+                job.finished_at = time.time()
+                job.emit(job.status)
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        by_status: Dict[str, int] = {}
+        for job in self._jobs.values():
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize(),
+            "jobs": by_status,
+        }
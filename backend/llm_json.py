@@ -0,0 +1,158 @@
+# llm_json.py
+import re
+import json
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+_FENCE = re.compile(r"```[a-zA-Z]*[ \t]*\n?")
+_DECODER = json.JSONDecoder()
+
+
+class RecoveredJSON(NamedTuple):
+    data: Optional[Any]
+    # Ответ оборван (закрыты не все скобки) — есть смысл запросить продолжение
+    truncated: bool
+    # Часть ответа отброшена или скобки закрыты искусственно
+    repaired: bool
+
+
+def strip_code_fences(text: str) -> str:
+    """Убирает markdown-обёртку ```json ... ```, в том числе незакрытую"""
+    return _FENCE.sub("", text)
+
+
+def _scan(text: str, start: int) -> Tuple[Optional[int], List[Tuple[int, str]]]:
+    """Проходит JSON от start: конец объекта (если он закрыт) и безопасные точки обрезки
+
+    Безопасная точка — позиция сразу после полностью записанного значения внутри контейнера;
+    к ней сохраняется строка закрывающих скобок для всех открытых контейнеров.
+    """
+    stack: List[str] = []
+    # Для объектов: ждём ли сейчас ключ (True) или значение (False)
+    expect_key: List[bool] = []
+    safe: List[Tuple[int, str]] = []
+    in_string = False
+    escaped = False
+    string_is_key = False
+
+    def closers() -> str:
+        return "".join("}" if c == "{" else "]" for c in reversed(stack))
+
+    i = start
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+                if not string_is_key:
+                    safe.append((i + 1, closers()))
+            i += 1
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_is_key = bool(stack) and stack[-1] == "{" and expect_key[-1]
+        elif ch in "{[":
+            stack.append(ch)
+            expect_key.append(ch == "{")
+        elif ch in "}]":
+            if not stack:
+                return None, safe
+            stack.pop()
+            expect_key.pop()
+            if not stack:
+                return i + 1, safe
+            safe.append((i + 1, closers()))
+        elif ch == ":":
+            if expect_key:
+                expect_key[-1] = False
+        elif ch == ",":
+            # Предыдущее значение (в том числе число или литерал) завершено запятой
+            safe.append((i, closers()))
+            if stack and stack[-1] == "{":
+                expect_key[-1] = True
+        i += 1
+    return None, safe
+
+
+def recover_json(response: str) -> RecoveredJSON:
+    """JSON-объект из ответа модели: без markdown, а оборванный — до последнего целого поля"""
+    text = strip_code_fences(response) if "```" in response else response
+    start = text.find("{")
+    if start < 0:
+        return RecoveredJSON(None, False, False)
+
+    # Обычный случай — целый объект: разбираем C-парсером, посимвольный проход не нужен
+    try:
+        data, _ = _DECODER.raw_decode(text, start)
+        return RecoveredJSON(data, False, False)
+    except ValueError:
+        pass
+
+    end, safe_points = _scan(text, start)
+    if end is not None:
+        try:
+            return RecoveredJSON(json.loads(text[start:end]), False, False)
+        except ValueError:
+            pass
+        # Скобки сошлись, но внутри мусор — пробуем старый способ: до последней }
+        try:
+            return RecoveredJSON(json.loads(text[start:text.rfind("}") + 1]), False, True)
+        except ValueError:
+            return RecoveredJSON(None, False, False)
+
+    # Ответ оборван: обрезаем по последней безопасной точке и закрываем открытые скобки
+    for pos, closing in reversed(safe_points[-50:]):
+        candidate = text[start:pos].rstrip().rstrip(",") + closing
+        try:
+            return RecoveredJSON(json.loads(candidate), True, True)
+        except ValueError:
+            continue
+    return RecoveredJSON(None, True, False)
+
+
+# ==================== ЧИСЛА ИЗ ТЕКСТА ====================
+# Число с разделителями (в т.ч. неразрывными пробелами): «1 250 000,50», «1,250,000.00», «1.250.000»
+_NUMBER = re.compile(r"-?\d+(?:[.,'\s]\d+)*")
+_NUMBER_SEPARATORS = re.compile(r"[.,'\s]")
+_MULTIPLIER = re.compile(r"\s*(тыс|млн|млрд|thousand|million|billion)", re.IGNORECASE)
+_MULTIPLIERS = {"тыс": 1e3, "млн": 1e6, "млрд": 1e9, "thousand": 1e3, "million": 1e6, "billion": 1e9}
+
+
+def parse_number(text: str) -> Optional[float]:
+    """Первое число в строке с учётом разделителей разрядов; неоднозначное -> None
+
+    Разделитель, за которым ровно три цифры, или повторяющийся разделитель — это разряды;
+    единственная точка/запятая с другим числом цифр — десятичная. «5 млн» -> 5000000.
+    """
+    match = _NUMBER.search(text)
+    if not match:
+        return None
+    token = match.group()
+    groups = _NUMBER_SEPARATORS.split(token.lstrip("-"))
+    # Пробелы любого вида — один и тот же разделитель разрядов
+    separators = [" " if sep.isspace() else sep for sep in _NUMBER_SEPARATORS.findall(token)]
+
+    fraction = ""
+    if (
+        separators
+        and separators[-1] in ".,"
+        and separators.count(separators[-1]) == 1
+        and (len(groups[-1]) != 3 or groups[0] == "0")
+    ):
+        fraction = groups.pop()
+        separators.pop()
+    if separators:
+        if len(set(separators)) > 1 or len(groups[0]) > 3 or any(len(g) != 3 for g in groups[1:]):
+            return None
+
+    number = float(f"{''.join(groups)}.{fraction or 0}")
+    if token.startswith("-"):
+        number = -number
+    multiplier = _MULTIPLIER.match(text, match.end())
+    if multiplier:
+        number *= _MULTIPLIERS[multiplier.group(1).lower()]
+    return number
@@ -0,0 +1,214 @@
+# loadtest/fake_yandex.py
+"""Локальная заглушка Yandex IAM и Foundation Models для нагрузочных тестов без расхода квоты
+
+Запуск:
+    python loadtest/fake_yandex.py --port 8081 --latency-ms 1500 --error-rate 0.02 --rate-429 0.05
+    python loadtest/fake_yandex.py --write-key /tmp/fake_key.json   # ключ сервисного аккаунта для заглушки
+
+Бэкенд направляется на заглушку переменными окружения:
+    YANDEX_IAM_URL=http://127.0.0.1:8081/iam/v1/tokens
+    YANDEX_LLM_URL=http://127.0.0.1:8081
+    AUTHORIZED_KEY_CONTENT="$(cat /tmp/fake_key.json)"
+"""
+import os
+import json
+import random
+import asyncio
+import hashlib
+import argparse
+from string import Template
+from datetime import datetime, timedelta, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Ответ по умолчанию; $-плейсхолдеры подставляются для каждого запроса
+DEFAULT_TEMPLATE = json.dumps({
+    "extracted_data": {
+        "document_type": "$doc_type",
+        "parties": [
+            {"name": "ООО «Ромашка»", "role": "заказчик", "inn": "7701234567"},
+            {"name": "ИП Иванов $request_id", "role": "исполнитель"}
+        ],
+        "financial_terms": {"total_amount": "$amount", "currency": "RUB", "payment_terms": "30 дней"},
+        "dates": {"contract_date": "2024-01-15", "deadline": "2024-03-01"},
+        "obligations": ["Выполнить работы", "Оплатить работы"],
+        "missing_requisites": []
+    },
+    "risk_flags": [
+        {"level": "medium", "category": "financial", "description": "Нет неустойки за просрочку оплаты", "suggestion": "Добавить пункт о пени"}
+    ],
+    "action_items": [
+        {"action": "Проверить реквизиты сторон", "deadline": None, "responsible": "юрист"}
+    ],
+    "summary": "Договор на $prompt_chars символов промпта, сумма $amount RUB",
+    "confidence_score": 0.85
+}, ensure_ascii=False).replace('"$amount"', "$amount")
+
+DOC_TYPES = ("contract", "invoice", "act", "other")
+
+
+class FakeConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency_ms = args.latency_ms
+        self.latency_sigma = args.latency_sigma
+        self.iam_latency_ms = args.iam_latency_ms
+        self.error_rate = args.error_rate
+        self.rate_429 = args.rate_429
+        self.max_concurrency = args.max_concurrency
+        self.stream_chunks = args.stream_chunks
+        self.template = Template(open(args.template, encoding="utf-8").read() if args.template else DEFAULT_TEMPLATE)
+        self.seed = args.seed
+
+
+def render_response(template: Template, prompt: str, request_id: int) -> str:
+    """Детерминированные значения по хэшу промпта: одинаковый документ — одинаковый ответ"""
+    digest = int(hashlib.sha256(prompt.encode()).hexdigest()[:8], 16)
+    return template.safe_substitute(
+        request_id=request_id,
+        prompt_chars=len(prompt),
+        amount=(digest % 1000) * 1000 + 1000,
+        doc_type=DOC_TYPES[digest % len(DOC_TYPES)],
+    )
+
+
+def create_app(config: FakeConfig) -> FastAPI:
+    app = FastAPI(title="Fake Yandex Cloud")
+    rng = random.Random(config.seed)
+    stats = {"iam": 0, "completions": 0, "in_flight": 0, "peak_in_flight": 0, "by_status": {}}
+
+    def sample_latency() -> float:
+        if config.latency_ms <= 0:
+            return 0.0
+        # Логнормальное распределение: медиана latency_ms, длинный хвост при большом sigma
+        return rng.lognormvariate(0, config.latency_sigma) * config.latency_ms / 1000
+
+    def count(status_code: int) -> None:
+        stats["by_status"][status_code] = stats["by_status"].get(status_code, 0) + 1
+
+    @app.post("/iam/v1/tokens")
+    async def iam_token(request: Request):
+        body = await request.json()
+        stats["iam"] += 1
+        await asyncio.sleep(config.iam_latency_ms / 1000)
+        if not body.get("jwt"):
+            return JSONResponse({"message": "jwt is required"}, status_code=400)
+        expires_at = datetime.now(timezone.utc) + timedelta(hours=12)
+        return {"iamToken": f"fake-iam-{stats['iam']}", "expiresAt": expires_at.strftime("%Y-%m-%dT%H:%M:%S.%fZ")}
+
+    @app.post("/foundationModels/v1/completion")
+    async def completion(request: Request):
+        body = await request.json()
+        stats["completions"] += 1
+        request_id = stats["completions"]
+        if not request.headers.get("authorization", "").startswith("Bearer "):
+            count(401)
+            return JSONResponse({"error": {"message": "Unauthorized"}}, status_code=401)
+
+        # Квота каталога: сверх лимита одновременных запросов — 429, как у настоящего API
+        if config.max_concurrency and stats["in_flight"] >= config.max_concurrency:
+            count(429)
+            return JSONResponse({"error": {"message": "ai.textGenerationCompletionSessionsCount.count gauge quota limit exceed"}},
+                                status_code=429, headers={"Retry-After": "1"})
+        roll = rng.random()
+        if roll < config.rate_429:
+            count(429)
+            return JSONResponse({"error": {"message": "Too many requests"}}, status_code=429)
+        if roll < config.rate_429 + config.error_rate:
+            count(503)
+            return JSONResponse({"error": {"message": "Service unavailable"}}, status_code=503)
+
+        prompt = "\n".join(m.get("text", "") for m in body.get("messages", []))
+        text = render_response(config.template, prompt, request_id)
+        stream = body.get("completionOptions", {}).get("stream", False)
+        latency = sample_latency()
+
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        count(200)
+
+        def payload(partial: str, final: bool) -> str:
+            return json.dumps({"result": {
+                "alternatives": [{"message": {"role": "assistant", "text": partial},
+                                  "status": "ALTERNATIVE_STATUS_FINAL" if final else "ALTERNATIVE_STATUS_PARTIAL"}],
+                "usage": {"inputTextTokens": str(len(prompt) // 3), "completionTokens": str(len(text) // 3)},
+                "modelVersion": "fake",
+            }}, ensure_ascii=False)
+
+        if not stream:
+            try:
+                await asyncio.sleep(latency)
+            finally:
+                stats["in_flight"] -= 1
+            return JSONResponse(json.loads(payload(text, True)))
+
+        async def lines():
+            # Как и настоящий API: каждая строка содержит весь текст, сгенерированный к этому моменту
+            try:
+                step = max(1, len(text) // config.stream_chunks)
+                for end in range(step, len(text) + step, step):
+                    await asyncio.sleep(latency / config.stream_chunks)
+                    yield payload(text[:end], end >= len(text)) + "\n"
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(lines(), media_type="application/json")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        stats.update(iam=0, completions=0, peak_in_flight=stats["in_flight"], by_status={})
+        return stats
+
+    return app
+
+
+def write_key(path: str) -> None:
+    """Одноразовый ключ сервисного аккаунта: заглушка подпись не проверяет, но бэкенду нужен валидный RSA-ключ"""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"id": "fake-key", "service_account_id": "fake-sa", "private_key": pem}, f)
+    print(f"✅ Ключ записан в {path}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Заглушка Yandex IAM и completion API")
+    parser.add_argument("--host", default=os.getenv("FAKE_YANDEX_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_YANDEX_PORT", 8081)))
+    parser.add_argument("--latency-ms", type=float, default=float(os.getenv("FAKE_LATENCY_MS", 1500)),
+                        help="медиана задержки ответа")
+    parser.add_argument("--latency-sigma", type=float, default=float(os.getenv("FAKE_LATENCY_SIGMA", 0.4)),
+                        help="разброс логнормального распределения (0 — фиксированная задержка)")
+    parser.add_argument("--iam-latency-ms", type=float, default=float(os.getenv("FAKE_IAM_LATENCY_MS", 100)))
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("FAKE_ERROR_RATE", 0)),
+                        help="доля ответов 503")
+    parser.add_argument("--rate-429", type=float, default=float(os.getenv("FAKE_RATE_429", 0)),
+                        help="доля случайных ответов 429")
+    parser.add_argument("--max-concurrency", type=int, default=int(os.getenv("FAKE_MAX_CONCURRENCY", 0)),
+                        help="квота одновременных запросов, сверх неё — 429 (0 — без квоты)")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="число строк в потоковом ответе")
+    parser.add_argument("--template", default=os.getenv("FAKE_TEMPLATE"),
+                        help="файл с JSON-ответом модели; плейсхолдеры $amount, $doc_type, $prompt_chars, $request_id")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--write-key", metavar="PATH", help="записать ключ сервисного аккаунта и выйти")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.write_key:
+        write_key(args.write_key)
+    else:
+        uvicorn.run(create_app(FakeConfig(args)), host=args.host, port=args.port, log_level="warning")
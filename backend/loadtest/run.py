@@ -0,0 +1,195 @@
+# loadtest/run.py
+"""Нагрузочный прогон API: p50/p95/p99 и пропускная способность на нескольких уровнях параллелизма
+
+Бэкенд должен смотреть на заглушку (см. loadtest/fake_yandex.py), иначе тратится настоящая квота:
+    python loadtest/fake_yandex.py --port 8081 &
+    YANDEX_IAM_URL=http://127.0.0.1:8081/iam/v1/tokens YANDEX_LLM_URL=http://127.0.0.1:8081 \\
+        AUTHORIZED_KEY_CONTENT="$(cat /tmp/fake_key.json)" uvicorn main_simple:app --port 8000 &
+    python loadtest/run.py --base-url http://127.0.0.1:8000 --concurrency 1,4,16 --requests 50
+"""
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from io import BytesIO
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+SCENARIOS = ("analyze", "history", "generate-pdf")
+
+
+def make_pdf(seed: str) -> bytes:
+    """Небольшой договор; seed делает текст уникальным, чтобы не попадать в кэш анализа"""
+    from reportlab.pdfgen import canvas
+
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer)
+    lines = [
+        f"Contract No {seed}",
+        "1. Subject: the Contractor performs software development services.",
+        f"2. Price: {abs(hash(seed)) % 900000 + 100000} RUB, payment within 30 days.",
+        "3. Term: from 2024-01-15 till 2024-03-01.",
+        "4. Liability: penalties are not specified.",
+    ]
+    for i, line in enumerate(lines):
+        c.drawString(50, 800 - i * 20, line)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+class LoadRunner:
+    def __init__(self, base_url: str, email: str, password: str, unique_documents: bool, timeout: float):
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=1000, max_keepalive_connections=1000),
+        )
+        self.email = email
+        self.password = password
+        self.unique_documents = unique_documents
+        self.headers: Dict[str, str] = {}
+        self.analysis_ids: List[int] = []
+        self._static_pdf = make_pdf("static")
+
+    async def login(self) -> None:
+        await self.client.post("/auth/register", json={"email": self.email, "password": self.password})
+        resp = await self.client.post("/auth/login", data={"username": self.email, "password": self.password})
+        resp.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+
+    async def seed_history(self) -> None:
+        """Для generate-pdf нужны анализы в истории"""
+        resp = await self.client.get("/api/history", params={"limit": 50}, headers=self.headers)
+        self.analysis_ids = [a["id"] for a in resp.json().get("analyses", [])]
+        if not self.analysis_ids:
+            await self.analyze()
+            resp = await self.client.get("/api/history", params={"limit": 50}, headers=self.headers)
+            self.analysis_ids = [a["id"] for a in resp.json().get("analyses", [])]
+
+    async def analyze(self) -> bool:
+        pdf = make_pdf(uuid.uuid4().hex) if self.unique_documents else self._static_pdf
+        resp = await self.client.post(
+            "/api/analyze", files={"file": ("load.pdf", pdf, "application/pdf")}, headers=self.headers
+        )
+        return resp.status_code == 200 and resp.json().get("status") == "success"
+
+    async def history(self) -> bool:
+        resp = await self.client.get("/api/history", params={"limit": 10}, headers=self.headers)
+        return resp.status_code == 200 and resp.json().get("status") == "success"
+
+    async def generate_pdf(self) -> bool:
+        analysis_id = self.analysis_ids[int(time.monotonic() * 1000) % len(self.analysis_ids)]
+        resp = await self.client.get(f"/api/generate-pdf/{analysis_id}", headers=self.headers)
+        return resp.status_code == 200 and resp.content.startswith(b"%PDF")
+
+    def scenario(self, name: str) -> Callable[[], Awaitable[bool]]:
+        return {"analyze": self.analyze, "history": self.history, "generate-pdf": self.generate_pdf}[name]
+
+    async def run_level(self, name: str, concurrency: int, requests: int) -> dict:
+        """requests запросов, не больше concurrency одновременно (замкнутая модель нагрузки)"""
+        call = self.scenario(name)
+        latencies: List[float] = []
+        errors = 0
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    ok = await call()
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        return {
+            "scenario": name,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": errors,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "max_ms": round(max(latencies, default=0) * 1000, 1),
+        }
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def print_table(rows: List[dict]) -> None:
+    header = f"{'scenario':<14}{'conc':>6}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['scenario']:<14}{r['concurrency']:>6}{r['requests']:>7}{r['errors']:>6}"
+              f"{r['throughput_rps']:>9}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+async def main(args: argparse.Namespace) -> List[dict]:
+    runner = LoadRunner(args.base_url, args.email, args.password, not args.same_document, args.timeout)
+    rows = []
+    try:
+        await runner.login()
+        if "generate-pdf" in args.scenarios:
+            await runner.seed_history()
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                requests = max(args.requests, concurrency)
+                row = await runner.run_level(name, concurrency, requests)
+                rows.append(row)
+                print(f"✅ {name} x{concurrency}: {row['throughput_rps']} rps, p95 {row['p95_ms']} ms", file=sys.stderr)
+    finally:
+        await runner.aclose()
+    return rows
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон DocuBot API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"через запятую: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="уровни параллелизма через запятую")
+    parser.add_argument("--requests", type=int, default=50, help="запросов на каждый уровень")
+    parser.add_argument("--email", default="loadtest@example.com")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--same-document", action="store_true",
+                        help="один и тот же PDF (проверка кэша) вместо уникальных")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", metavar="PATH", help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rows = asyncio.run(main(args))
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"base_url": args.base_url, "results": rows}, f, ensure_ascii=False, indent=2)
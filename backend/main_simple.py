@@ -1,36 +1,35 @@
 import sys
 import os
 import json
-import time
-import jwt
-import requests
+import base64
+import httpx
 import logging
+import asyncio
 import hashlib
+import zipfile
 from io import BytesIO
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from typing import Annotated, AsyncIterator, Callable, List, NamedTuple, Optional, Tuple
 from enum import Enum
-from functools import lru_cache
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, BeforeValidator, Field, PrivateAttr, TypeAdapter, ValidationError, model_validator
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
-from database import get_db, AnalysisHistory, init_db, User
-from sqlalchemy import desc, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer_group
+from database import get_async_db, AnalysisHistory, AnalysisCacheEntry, AsyncSessionLocal, async_engine, init_db, User, UserStats, bump_user_stats, rebuild_user_stats
+from sqlalchemy import and_, delete, desc, or_, select
+from sqlalchemy.exc import IntegrityError
 
 from auth import (
-    UserCreate, UserLogin, Token, UserResponse,
+    UserCreate, Token, UserResponse,
     create_user, get_user, verify_password,
     create_access_token, get_current_user,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from datetime import timedelta
-from fastapi import status
-from fastapi.security import OAuth2PasswordRequestForm
 
 # PDF генерация
 from reportlab.lib.pagesizes import A4
@@ -45,15 +44,51 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# ==================== БАЗА ДАННЫХ ====================
-from database import get_db, AnalysisHistory, init_db
-
 # ==================== КЭШИРОВАНИЕ ====================
-@lru_cache(maxsize=50)
+from cache import AnalysisCache, SingleFlight
+from jobs import Job, JobManager, JobQueueFullError, sse_event
+from chunking import split_into_chunks, merge_chunk_analyses
+from pdf_extract import PDFExtractor, PDFExtractionError
+from uploads import SpooledUpload, UploadSizeLimitMiddleware, spool_upload, unpack_zip
+from text_compact import CompactedText, compact_text
+from iam_token import get_token_manager, load_authorized_key
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, send_with_retries
+from admission import AdmissionQueueFullError, FairLimiter
+from llm_json import parse_number, recover_json, strip_code_fences
+
+# Версия промпта: меняйте при изменении DocumentAgent.build_prompt, чтобы не отдавать старые результаты
+PROMPT_VERSION = "combined-v1"
+PERSISTENT_CACHE_ENABLED = os.getenv("PERSISTENT_CACHE_ENABLED", "1") == "1"
+# Записи, которые не читались столько дней, удаляются (0 — хранить бессрочно)
+PERSISTENT_CACHE_TTL_DAYS = float(os.getenv("PERSISTENT_CACHE_TTL_DAYS", 30))
+PERSISTENT_CACHE_PRUNE_INTERVAL = float(os.getenv("PERSISTENT_CACHE_PRUNE_INTERVAL", 3600))
+
 def get_text_hash(text: str) -> str:
-    return hashlib.md5(text[:2000].encode()).hexdigest()
+    return hashlib.sha256(text.encode()).hexdigest()
 
-_analysis_cache: Dict[str, 'AnalysisResult'] = {}
+def get_cache_key(text_hash: str, model_uri: str) -> str:
+    """Ключ кэша: хэш содержимого + версия промпта + модель"""
+    return hashlib.sha256(f"{text_hash}:{PROMPT_VERSION}:{model_uri}".encode()).hexdigest()
+
+# Ограниченный LRU-кэш результатов (лимит записей + бюджет памяти + TTL)
+_analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 500)),
+    max_bytes=int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", 50 * 1024 * 1024)),
+    ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL", 0)),
+)
+
+# Быстрый путь для повторных загрузок: sha256 байтов файла -> (текст, результат)
+_upload_cache = AnalysisCache(
+    max_entries=int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", 1000)),
+    max_bytes=int(os.getenv("UPLOAD_CACHE_MAX_BYTES", 50 * 1024 * 1024)),
+    ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL", 0)),
+)
+
+# Одновременные анализы одного и того же текста выполняются один раз
+_inflight_analyses = SingleFlight()
+
+# Суммарная экономия от сжатия текста перед промптом
+_compaction_totals = {"documents": 0, "chars_saved": 0, "tokens_saved_estimate": 0}
 
 # ==================== МОДЕЛИ ====================
 class DocumentType(str, Enum):
@@ -70,63 +105,179 @@ class RiskLevel(str, Enum):
     HIGH = "high"
     CRITICAL = "critical"  # ✅ ДОБАВЛЕНО
 
+# Мягкое приведение ответа модели: вместо ошибки валидации — значение по умолчанию
+def _lenient_number(value):
+    """1250000, "1 250 000,50 руб.", "12%" -> число; нечисловое или неоднозначное -> None"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    return parse_number(str(value))
+
+def _lenient_int(value):
+    number = _lenient_number(value)
+    return None if number is None else int(round(number))
+
+def _lenient_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(v) for v in value)
+    return str(value)
+
+def _lenient_enum(enum_cls, default):
+    values = {e.value for e in enum_cls}
+    def coerce(value):
+        value = str(getattr(value, "value", value) or "").strip().lower()
+        return value if value in values else default
+    return BeforeValidator(coerce)
+
+def _default_if_none(default):
+    return BeforeValidator(lambda value: default if value is None else value)
+
+def _clamp_confidence(value):
+    number = _lenient_number(value)
+    if number is None:
+        return 0.5
+    # "85" или "85%" — проценты
+    if 1 < number <= 100:
+        number /= 100
+    return min(1.0, max(0.0, number))
+
+def _text_list(value):
+    if not isinstance(value, (list, tuple)):
+        return [] if value is None else [_lenient_text(value)]
+    return [_lenient_text(v) for v in value if v is not None]
+
+def _valid_items(model):
+    """Элементы списка, которые не прошли валидацию, отбрасываются по одному, а не роняют весь результат"""
+    list_adapter = TypeAdapter(List[model])
+    def coerce(value):
+        if not isinstance(value, (list, tuple)):
+            return []
+        # Обычно список валиден целиком — проверяем его за один вызов
+        try:
+            return list_adapter.validate_python(value)
+        except ValidationError:
+            pass
+        items = []
+        for item in value:
+            try:
+                items.append(model.model_validate(item))
+            except ValidationError as e:
+                logger.warning(f"Error parsing {model.__name__}: {e.errors()[0]['msg']}")
+        return items
+    return BeforeValidator(coerce)
+
+LenientFloat = Annotated[Optional[float], BeforeValidator(_lenient_number)]
+LenientInt = Annotated[Optional[int], BeforeValidator(_lenient_int)]
+LenientText = Annotated[Optional[str], BeforeValidator(_lenient_text)]
+TextList = Annotated[List[str], BeforeValidator(_text_list)]
+
 class RiskFlag(BaseModel):
-    level: RiskLevel
-    category: str
-    title: Optional[str] = None
-    description: str
-    legal_basis: Optional[str] = None
-    suggestion: str
-    impact: Optional[str] = None
+    level: Annotated[RiskLevel, _lenient_enum(RiskLevel, "low")]
+    category: Annotated[str, _default_if_none("other")]
+    title: LenientText = None
+    description: Annotated[str, _default_if_none("")]
+    legal_basis: LenientText = None
+    suggestion: Annotated[str, _default_if_none("")]
+    impact: LenientText = None
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _fill_defaults(cls, data):
+        if isinstance(data, dict):
+            data = {"level": "low", "category": "other", "description": "", "suggestion": "", **data}
+        return data
 
 class Party(BaseModel):
-    name: str
-    role: str = "other"
-    inn: Optional[str] = None
-    address: Optional[str] = None
+    name: Annotated[str, BeforeValidator(_lenient_text)]
+    role: Annotated[str, _default_if_none("other")] = "other"
+    inn: LenientText = None
+    address: LenientText = None
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _from_name(cls, data):
+        # Модель иногда возвращает стороны просто строками
+        if not isinstance(data, (dict, BaseModel)):
+            return {"name": str(data)}
+        if isinstance(data, dict) and data.get("name") is None:
+            return {**data, "name": "Unknown"}
+        return data
 
 class FinancialTerms(BaseModel):
-    total_amount: Optional[float] = None
-    currency: str = "RUB"
-    interest_rate: Optional[str] = None
-    interest_rate_numeric: Optional[float] = None
-    payment_schedule: Optional[str] = None
-    loan_term_days: Optional[int] = None
-    late_fee_percent: Optional[float] = None
-    late_fee_description: Optional[str] = None
+    total_amount: LenientFloat = None
+    currency: Annotated[str, _default_if_none("RUB")] = "RUB"
+    interest_rate: LenientText = None
+    interest_rate_numeric: LenientFloat = None
+    payment_schedule: LenientText = None
+    loan_term_days: LenientInt = None
+    late_fee_percent: LenientFloat = None
+    late_fee_description: LenientText = None
 
 class DatesData(BaseModel):
-    signature: Optional[str] = None
-    start_date: Optional[str] = None
-    end_date: Optional[str] = None
-    payment_due: Optional[str] = None
+    signature: LenientText = None
+    start_date: LenientText = None
+    end_date: LenientText = None
+    payment_due: LenientText = None
 
 class ExtractedData(BaseModel):
-    document_type: DocumentType
-    document_subtype: str = "other"
-    document_number: Optional[str] = None
-    document_date: Optional[str] = None
-    parties: List[Party] = Field(default_factory=list)
-    financial_terms: FinancialTerms = Field(default_factory=FinancialTerms)
-    dates: DatesData = Field(default_factory=DatesData)
-    obligations: List[str] = Field(default_factory=list)
-    penalties: Optional[str] = None
-    termination_conditions: Optional[str] = None
-    dispute_resolution: Optional[str] = None
-    missing_requisites: List[str] = Field(default_factory=list)
+    document_type: Annotated[DocumentType, _lenient_enum(DocumentType, "other")]
+    document_subtype: Annotated[str, _default_if_none("other")] = "other"
+    document_number: LenientText = None
+    document_date: LenientText = None
+    parties: Annotated[List[Party], _valid_items(Party)] = Field(default_factory=list)
+    financial_terms: Annotated[FinancialTerms, _default_if_none({})] = Field(default_factory=FinancialTerms)
+    dates: Annotated[DatesData, _default_if_none({})] = Field(default_factory=DatesData)
+    obligations: TextList = Field(default_factory=list)
+    penalties: LenientText = None
+    termination_conditions: LenientText = None
+    dispute_resolution: LenientText = None
+    missing_requisites: TextList = Field(default_factory=list)
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _default_type(cls, data):
+        if isinstance(data, dict) and "document_type" not in data:
+            return {**data, "document_type": "other"}
+        return data
 
 class ActionItem(BaseModel):
-    priority: Optional[str] = "medium"
-    action: str
-    deadline: Optional[str] = None
+    priority: LenientText = "medium"
+    action: Annotated[str, BeforeValidator(_lenient_text)]
+    deadline: LenientText = None
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _from_text(cls, data):
+        if not isinstance(data, (dict, BaseModel)):
+            return {"action": str(data)}
+        if isinstance(data, dict) and not data.get("action"):
+            return {**data, "action": "Check manually"}
+        return data
 
 class AnalysisResult(BaseModel):
-    extracted_data: ExtractedData
-    risk_flags: List[RiskFlag] = Field(default_factory=list)
-    action_items: List[ActionItem] = Field(default_factory=list)
-    summary: str
-    confidence_score: float = Field(ge=0, le=1)
-    analysis_notes: Optional[str] = None
+    extracted_data: Annotated[ExtractedData, _default_if_none({})]
+    risk_flags: Annotated[List[RiskFlag], _valid_items(RiskFlag)] = Field(default_factory=list)
+    action_items: Annotated[List[ActionItem], _valid_items(ActionItem)] = Field(default_factory=list)
+    summary: Annotated[str, BeforeValidator(_lenient_text)]
+    confidence_score: Annotated[float, BeforeValidator(_clamp_confidence)] = Field(ge=0, le=1)
+    analysis_notes: LenientText = None
+    # Неполный результат (заглушка, оборванный ответ, упавшие фрагменты) в кэши не попадает
+    _cacheable: bool = PrivateAttr(default=True)
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _fill_defaults(cls, data):
+        if isinstance(data, dict):
+            data = {"extracted_data": {}, "summary": "Анализ завершён", "confidence_score": 0.5, **data}
+            if data["summary"] is None:
+                data["summary"] = "Анализ завершён"
+        return data
+
+# Схема ответа модели компилируется один раз: разбор и сериализация без ручной сборки по полям
+_RESULT_ADAPTER = TypeAdapter(AnalysisResult)
 
 class DocumentUploadResponse(BaseModel):
     status: str
@@ -134,116 +285,376 @@ class DocumentUploadResponse(BaseModel):
     error: Optional[str] = None
 
 # ==================== YANDEX GPT SERVICE ====================
+# Базовый адрес Foundation Models; для нагрузочных тестов — локальная заглушка (loadtest/fake_yandex.py)
+YANDEX_LLM_URL = os.getenv("YANDEX_LLM_URL", "https://llm.api.cloud.yandex.net").rstrip("/")
+COMPLETION_URL = f"{YANDEX_LLM_URL}/foundationModels/v1/completion"
+
+# Пул соединений к Yandex Cloud (keep-alive переиспользуется между запросами)
+GPT_MAX_CONNECTIONS = int(os.getenv("GPT_MAX_CONNECTIONS", 50))
+GPT_MAX_KEEPALIVE = int(os.getenv("GPT_MAX_KEEPALIVE", 20))
+GPT_KEEPALIVE_EXPIRY = float(os.getenv("GPT_KEEPALIVE_EXPIRY", 30))
+GPT_CONNECT_TIMEOUT = float(os.getenv("GPT_CONNECT_TIMEOUT", 5))
+GPT_READ_TIMEOUT = float(os.getenv("GPT_READ_TIMEOUT", 60))
+GPT_POOL_TIMEOUT = float(os.getenv("GPT_POOL_TIMEOUT", 30))
+
+# Повторы для 429/5xx и circuit breaker на время недоступности провайдера
+GPT_MAX_ATTEMPTS = int(os.getenv("GPT_MAX_ATTEMPTS", 3))
+GPT_RETRY_BASE_DELAY = float(os.getenv("GPT_RETRY_BASE_DELAY", 0.5))
+GPT_RETRY_MAX_DELAY = float(os.getenv("GPT_RETRY_MAX_DELAY", 8))
+GPT_BREAKER_THRESHOLD = int(os.getenv("GPT_BREAKER_THRESHOLD", 5))
+GPT_BREAKER_RECOVERY = float(os.getenv("GPT_BREAKER_RECOVERY", 30))
+
+# Квота каталога Yandex: общий лимит одновременных вызовов, очередь по кругу между пользователями
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", 8))
+GPT_MAX_PER_USER = int(os.getenv("GPT_MAX_PER_USER", 0))
+GPT_MAX_QUEUE = int(os.getenv("GPT_MAX_QUEUE", 200))
+
+# Дозапрос, если ответ оборвался на maxTokens (0 — только восстановление того, что пришло)
+CONTINUATION_MAX_TOKENS = int(os.getenv("CONTINUATION_MAX_TOKENS", 600))
+CONTINUE_PROMPT = "Ответ оборвался. Продолжи JSON точно с места обрыва, без повторов, пояснений и markdown."
+
 class YandexGPTService:
     def __init__(self, folder_id: str, key_path: str = None):
         self.folder_id = folder_id
-        self.iam_token = None
-        self.token_expires_at = 0
-        
-        # 🔑 Читаем ключ из переменной окружения (приоритет для Railway)
-        key_content = os.getenv('AUTHORIZED_KEY_CONTENT')
-        if key_content:
-            self.key_data = json.loads(key_content)
-            logger.info("✅ Ключ загружен из переменной окружения")
-        # 🔑 Читаем из файла authorized_key.json (локально)
-        elif os.path.isfile('authorized_key.json'):
-            with open('authorized_key.json', 'r', encoding='utf-8') as f:
-                self.key_data = json.load(f)
-            logger.info("✅ Ключ загружен из файла authorized_key.json")
-        # 🔑 Фолбэк: файл по пути (если указан)
-        elif key_path and os.path.isfile(key_path):
-            with open(key_path, 'r', encoding='utf-8') as f:
-                self.key_data = json.load(f)
-            logger.info(f"✅ Ключ загружен из файла {key_path}")
-        else:
-            raise RuntimeError("❌ Не найден ключ Yandex GPT! Установите AUTHORIZED_KEY_CONTENT")
-        
-        self.service_account_id = self.key_data['service_account_id']
-        self.private_key = self.key_data['private_key']
-        self.key_id = self.key_data['id']
-    
-    def get_iam_token(self) -> str:
-        now = time.time()
-        if self.iam_token and now < self.token_expires_at:
-            return self.iam_token
-        
-        payload = {
-            'aud': "https://iam.api.cloud.yandex.net/iam/v1/tokens",
-            'iss': self.service_account_id,
-            'iat': int(now),
-            'exp': int(now) + 3600
-        }
-        headers = {'kid': self.key_id, 'alg': 'PS256', 'typ': 'JWT'}
-        encoded_token = jwt.encode(payload, self.private_key, algorithm='PS256', headers=headers)
-        
-        resp = requests.post(
-            "https://iam.api.cloud.yandex.net/iam/v1/tokens",
-            headers={"Content-Type": "application/json"},
-            json={"jwt": encoded_token}
+        self.model_uri = f"gpt://{folder_id}/yandexgpt-lite"
+        self._client: Optional[httpx.AsyncClient] = None
+        self.breaker = CircuitBreaker(
+            failure_threshold=GPT_BREAKER_THRESHOLD,
+            recovery_timeout=GPT_BREAKER_RECOVERY,
         )
-        if resp.status_code != 200:
-            raise Exception(f"Failed to get IAM token: {resp.text}")
-        
-        self.iam_token = resp.json()["iamToken"]
-        self.token_expires_at = now + 3600
-        return self.iam_token
-    
-    def call_gpt(self, prompt: str, max_tokens: int = 1200) -> str:
-        iam_token = self.get_iam_token()
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {iam_token}",
-            "x-folder-id": self.folder_id
-        }
-        data = {
-            "modelUri": f"gpt://{self.folder_id}/yandexgpt-lite",
+        self.retry_policy = RetryPolicy(
+            max_attempts=GPT_MAX_ATTEMPTS,
+            base_delay=GPT_RETRY_BASE_DELAY,
+            max_delay=GPT_RETRY_MAX_DELAY,
+        )
+        self.limiter = FairLimiter(
+            max_concurrent=GPT_MAX_CONCURRENCY,
+            max_per_user=GPT_MAX_PER_USER,
+            max_queue=GPT_MAX_QUEUE,
+        )
+        # IAM-токен общий для процесса и обновляется в фоне
+        self.tokens = get_token_manager(load_authorized_key(key_path))
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий AsyncClient с keep-alive пулом (создаётся лениво внутри event loop)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=GPT_MAX_CONNECTIONS,
+                    max_keepalive_connections=GPT_MAX_KEEPALIVE,
+                    keepalive_expiry=GPT_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    GPT_READ_TIMEOUT,
+                    connect=GPT_CONNECT_TIMEOUT,
+                    pool=GPT_POOL_TIMEOUT,
+                ),
+            )
+        return self._client
+    
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def get_iam_token(self) -> str:
+        return await self.tokens.get_token()
+    
+    def _completion_payload(
+        self, prompt: str, max_tokens: int, stream: bool = False, continue_from: Optional[str] = None
+    ) -> dict:
+        messages = [{"role": "user", "text": prompt}]
+        if continue_from:
+            # Оборванный ответ возвращаем модели как её собственный и просим дописать
+            messages += [
+                {"role": "assistant", "text": continue_from},
+                {"role": "user", "text": CONTINUE_PROMPT},
+            ]
+        return {
+            "modelUri": self.model_uri,
             "completionOptions": {
-                "stream": False,
+                "stream": stream,
                 "temperature": 0.1,
                 "maxTokens": max_tokens,
                 "preset": "balanced"
             },
-            "messages": [{"role": "user", "text": prompt}]
+            "messages": messages
         }
-        response = requests.post(url, headers=headers, json=data)
-        if response.status_code != 200:
-            raise Exception(f"GPT error: {response.text}")
-        return response.json()['result']['alternatives'][0]['message']['text']
+    
+    async def _auth_headers(self) -> dict:
+        iam_token = await self.get_iam_token()
+        return {
+            "Authorization": f"Bearer {iam_token}",
+            "x-folder-id": self.folder_id
+        }
+    
+    async def _send_completion(
+        self, prompt: str, max_tokens: int, stream: bool = False, continue_from: Optional[str] = None
+    ) -> httpx.Response:
+        """POST к completion с повторами и circuit breaker; токен берётся заново на каждую попытку"""
+        async def send() -> httpx.Response:
+            request = self.client.build_request(
+                "POST",
+                COMPLETION_URL,
+                headers=await self._auth_headers(),
+                json=self._completion_payload(prompt, max_tokens, stream=stream, continue_from=continue_from)
+            )
+            return await self.client.send(request, stream=stream)
+        
+        return await send_with_retries(send, self.breaker, self.retry_policy)
+    
+    async def call_gpt(
+        self, prompt: str, max_tokens: int = 1200, user_id=None, continue_from: Optional[str] = None
+    ) -> str:
+        """Вызов ждёт свободного слота квоты в очереди пользователя user_id"""
+        async with self.limiter.slot(user_id):
+            response = await self._send_completion(prompt, max_tokens, continue_from=continue_from)
+            return response.json()['result']['alternatives'][0]['message']['text']
+    
+    async def stream_gpt(self, prompt: str, max_tokens: int = 1200, user_id=None) -> AsyncIterator[str]:
+        """Потоковый вызов: отдаёт новые фрагменты текста по мере генерации"""
+        # Слот квоты занят до конца генерации
+        async with self.limiter.slot(user_id):
+            # Повторы возможны только до первого байта ответа
+            response = await self._send_completion(prompt, max_tokens, stream=True)
+            try:
+                # Каждая строка — JSON с накопленным текстом альтернативы
+                sent = 0
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    text = json.loads(line)['result']['alternatives'][0]['message']['text']
+                    if len(text) > sent:
+                        yield text[sent:]
+                        sent = len(text)
+            finally:
+                await response.aclose()
 
 # ==================== DOCUMENT AGENT ====================
+class DocumentTextError(Exception):
+    """Из документа не удалось извлечь текст"""
+
+# Колбэк прогресса: (этап, данные) — extracted, gpt_started, parsed
+StageCallback = Callable[[str, Optional[dict]], None]
+
+def _noop_stage(stage: str, data: Optional[dict] = None) -> None:
+    pass
+
+class PreparedUpload(NamedTuple):
+    upload_hash: str
+    text: str
+    result: Optional["AnalysisResult"]
+    compaction: Optional[CompactedText] = None
+    
+    def extracted_event(self) -> dict:
+        event = {"chars": len(self.text), "cached": self.result is not None}
+        if self.compaction is not None:
+            event["compaction"] = self.compaction.stats()
+        return event
+
+# Максимальный размер загружаемого файла
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+
+# Лимиты извлечения текста (в пуле процессов) и разбиения длинных документов на фрагменты
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", 50))
+SINGLE_PASS_CHARS = int(os.getenv("SINGLE_PASS_CHARS", 4500))
+MAX_CHUNKS = int(os.getenv("MAX_CHUNKS", 16))
+CHUNK_CONCURRENCY = int(os.getenv("CHUNK_CONCURRENCY", 4))
+# Фрагменты режутся по границам пунктов и заполняются не до конца — закладываем ~80%
+CHUNK_FILL_RATIO = 0.8
+# Извлекаем не больше, чем поместится в MAX_CHUNKS фрагментов, иначе хвост документа отбрасывается
+_CHUNKED_MAX_CHARS = int(MAX_CHUNKS * SINGLE_PASS_CHARS * CHUNK_FILL_RATIO)
+PDF_MAX_CHARS = min(int(os.getenv("PDF_MAX_CHARS", _CHUNKED_MAX_CHARS)), _CHUNKED_MAX_CHARS)
+if PDF_MAX_CHARS < int(os.getenv("PDF_MAX_CHARS", 0)):
+    logger.warning(f"⚠️ PDF_MAX_CHARS уменьшен до {PDF_MAX_CHARS}: больше не помещается в MAX_CHUNKS={MAX_CHUNKS} фрагментов")
+
+# Пакетный анализ: число файлов, общий объём и сколько документов одного пакета идут в GPT одновременно
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", 200))
+MAX_BATCH_BYTES = int(os.getenv("MAX_BATCH_BYTES", 200 * 1024 * 1024))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+
+# Разделы ответа в порядке генерации (для событий "section" при стриминге)
+STREAM_SECTIONS = ("extracted_data", "risk_flags", "action_items", "summary")
+
+# Оборванные ответы: дописаны продолжением / спасены частично / не разобраны
+_json_recovery = {"truncated": 0, "continued": 0, "salvaged": 0, "failed": 0}
+
 class DocumentAgent:
-    def __init__(self, gpt_service: YandexGPTService):
+    def __init__(self, gpt_service: YandexGPTService, extractor: PDFExtractor):
         self.gpt = gpt_service
+        self.extractor = extractor
     
-    def extract_text_from_pdf(self, file_content: bytes) -> str:
+    async def extract_text_from_pdf(self, path: str) -> str:
         try:
-            from PyPDF2 import PdfReader
-            reader = PdfReader(BytesIO(file_content))
-            text = ""
-            for page in reader.pages[:10]:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-                if len(text) > 5000:
+            return await self.extractor.extract(path)
+        except PDFExtractionError as e:
+            raise DocumentTextError(str(e))
+    
+    async def prepare_upload(self, upload: SpooledUpload) -> PreparedUpload:
+        """Хэш файла, сжатый текст и готовый результат (если файл уже анализировался)"""
+        upload_hash = upload.sha256
+        cached = _upload_cache.get(upload_hash)
+        if cached is not None:
+            logger.info("⚡ Файл уже анализировался — PDF не парсим")
+            text, result = cached
+            return PreparedUpload(upload_hash, text, result)
+        
+        raw_text = await self.extract_text_from_pdf(upload.path)
+        compaction = compact_text(raw_text)
+        text = compaction.text
+        if not text or len(text) < 10:
+            raise DocumentTextError("Не удалось извлечь текст")
+        
+        _compaction_totals["documents"] += 1
+        _compaction_totals["chars_saved"] += compaction.chars_saved
+        _compaction_totals["tokens_saved_estimate"] += compaction.tokens_saved
+        logger.info(
+            f"🧹 Текст сжат: {compaction.chars_before} → {compaction.chars_after} симв. "
+            f"(~{compaction.tokens_saved} токенов сэкономлено)"
+        )
+        return PreparedUpload(upload_hash, text, None, compaction)
+    
+    async def analyze_upload(
+        self, upload: SpooledUpload, on_stage: StageCallback = _noop_stage, user_id=None
+    ) -> AnalysisResult:
+        """Анализ загруженного файла; повторная загрузка тех же байтов не парсит PDF"""
+        prepared = await self.prepare_upload(upload)
+        return await self.analyze_prepared(prepared, on_stage=on_stage, user_id=user_id)
+    
+    async def analyze_prepared(
+        self, prepared: PreparedUpload, on_stage: StageCallback = _noop_stage, user_id=None
+    ) -> AnalysisResult:
+        on_stage("extracted", prepared.extracted_event())
+        if prepared.result is not None:
+            on_stage("parsed", {"cached": True})
+            return prepared.result
+        
+        result = await self.analyze_document(prepared.text, on_stage=on_stage, user_id=user_id)
+        if result._cacheable:
+            _upload_cache.set(prepared.upload_hash, (prepared.text, result))
+        return result
+    
+    async def stream_analysis(self, text: str, user_id=None) -> AsyncIterator[Tuple[str, object]]:
+        """Потоковый анализ: события ("delta", текст), ("section", имя), ("result", AnalysisResult)"""
+        text_hash = get_text_hash(text)
+        cache_key = get_cache_key(text_hash, self.gpt.model_uri)
+        cached = _analysis_cache.get(cache_key)
+        if cached is None and PERSISTENT_CACHE_ENABLED:
+            cached = await self._load_persisted(cache_key)
+        if cached is not None:
+            yield "result", cached
+            return
+        if len(text) > SINGLE_PASS_CHARS:
+            # Длинный документ анализируется по частям — отдаём только итог
+            yield "result", await self.analyze_document(text, user_id=user_id)
+            return
+        
+        received = ""
+        search_from = 0
+        pending_sections = list(STREAM_SECTIONS)
+        prompt = self.build_prompt(text)
+        async for delta in self.gpt.stream_gpt(prompt, max_tokens=1200, user_id=user_id):
+            received += delta
+            yield "delta", delta
+            # Сообщаем клиенту, когда модель начала писать очередной раздел
+            while pending_sections:
+                pos = received.find(f'"{pending_sections[0]}"', search_from)
+                if pos < 0:
                     break
-            return text.strip()
-        except Exception as e:
-            logger.error(f"PDF parse error: {e}")
-            return "[Ошибка чтения PDF]"
+                search_from = pos
+                yield "section", pending_sections.pop(0)
+        
+        result = self.result_from_data(*await self._recover_json(prompt, received, user_id))
+        await self._remember(cache_key, text_hash, result)
+        yield "result", result
     
-    def analyze_document(self, text: str) -> AnalysisResult:
+    async def analyze_document(
+        self, text: str, on_stage: StageCallback = _noop_stage, user_id=None
+    ) -> AnalysisResult:
+        """user_id — ключ честной очереди к GPT (одинаковые тексты анализируются один раз)"""
         text_hash = get_text_hash(text)
-        if text_hash in _analysis_cache:
+        cache_key = get_cache_key(text_hash, self.gpt.model_uri)
+        cached = _analysis_cache.get(cache_key)
+        if cached is not None:
             logger.info("✅ Результат взят из кэша")
-            return _analysis_cache[text_hash]
+            on_stage("parsed", {"cached": True})
+            return cached
         
-        combined_prompt = f"""
+        on_stage("gpt_started", None)
+        result = await _inflight_analyses.do(
+            cache_key, lambda: self._analyze_uncached(text, text_hash, cache_key, user_id)
+        )
+        on_stage("parsed", {"cached": False, "risk_count": len(result.risk_flags)})
+        return result
+    
+    async def _analyze_uncached(self, text: str, text_hash: str, cache_key: str, user_id=None) -> AnalysisResult:
+        if PERSISTENT_CACHE_ENABLED:
+            persisted = await self._load_persisted(cache_key)
+            if persisted is not None:
+                logger.info("✅ Результат взят из персистентного кэша")
+                _analysis_cache.set(cache_key, persisted)
+                return persisted
+        
+        if len(text) > SINGLE_PASS_CHARS:
+            result = await self._analyze_chunked(text, user_id)
+        else:
+            prompt = self.build_prompt(text)
+            response = await self.gpt.call_gpt(prompt, max_tokens=1200, user_id=user_id)
+            result = self.result_from_data(*await self._recover_json(prompt, response, user_id))
+        await self._remember(cache_key, text_hash, result)
+        return result
+    
+    async def _analyze_chunked(self, text: str, user_id=None) -> AnalysisResult:
+        """Map-reduce для длинных документов: фрагменты по пунктам анализируются параллельно"""
+        chunks = split_into_chunks(text, SINGLE_PASS_CHARS)
+        skipped = max(0, len(chunks) - MAX_CHUNKS)
+        chunks = chunks[:MAX_CHUNKS]
+        semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
+        logger.info(f"📚 Длинный документ ({len(text)} симв.): {len(chunks)} фрагментов")
+        
+        async def analyze_chunk(i: int, chunk: str) -> Tuple[Optional[dict], bool]:
+            async with semaphore:
+                prompt = self.build_prompt(chunk, part=(i, len(chunks)))
+                response = await self.gpt.call_gpt(prompt, max_tokens=1200, user_id=user_id)
+            return await self._recover_json(prompt, response, user_id)
+        
+        responses = await asyncio.gather(
+            *(analyze_chunk(i, chunk) for i, chunk in enumerate(chunks, 1)),
+            return_exceptions=True
+        )
+        parts = []
+        complete = True
+        for i, response in enumerate(responses, 1):
+            if isinstance(response, Exception):
+                logger.warning(f"⚠️ Фрагмент {i} не проанализирован: {response}")
+                complete = False
+                continue
+            part, part_complete = response
+            complete = complete and part_complete
+            if part is not None:
+                parts.append(part)
+        if not parts:
+            errors = [r for r in responses if isinstance(r, Exception)]
+            if errors:
+                raise errors[0]
+            return self.parse_response("")
+        
+        data = merge_chunk_analyses(parts)
+        note = f"Документ проанализирован по частям: {len(parts)} из {len(chunks) + skipped}."
+        data["analysis_notes"] = "\n".join(filter(None, [data.get("analysis_notes"), note]))
+        result = self.assemble_result(data)
+        result._cacheable = complete
+        return result
+    
+    def build_prompt(self, text: str, part: Optional[Tuple[int, int]] = None) -> str:
+        fragment_note = f" (фрагмент {part[0]} из {part[1]}, анализируй только его)" if part else ""
+        return f"""
 Ты — профессиональный юрист-эксперт с 15-летним стажем по анализу юридических документов. 
 Твоя задача — найти ВСЕ риски и извлечь ВСЕ данные для защиты интересов пользователя.
 
-📄 ТЕКСТ ДОКУМЕНТА:
-{text[:4500]}
+📄 ТЕКСТ ДОКУМЕНТА{fragment_note}:
+{text[:SINGLE_PASS_CHARS]}
 
 ⚖️ ИНСТРУКЦИЯ ПО АНАЛИЗУ:
 
@@ -330,115 +741,157 @@ class DocumentAgent:
 - level: "critical" если есть риск потери денег или суда
 - Возвращай ТОЛЬКО JSON, без текста до и после
 """
-        response = self.gpt.call_gpt(combined_prompt, max_tokens=1200)
-        
-        try:
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            data = json.loads(response[start:end])
-        except Exception as e:
-            logger.warning(f"JSON parse error: {e}")
-            data = {
-                "extracted_data": {"document_type": "other", "parties": [], "financial_terms": {}, "dates": {}, "obligations": [], "penalties": None},
-                "risk_flags": [],
-                "action_items": ["Проверить документ вручную"],
-                "summary": "Не удалось проанализировать документ",
-                "confidence_score": 0.3
-            }
-        
-        # ✅ ИСПРАВЛЕНА СБОРКА ОБЪЕКТА
-        ext = data.get("extracted_data", {})
-        financial_raw = ext.get("financial_terms", {}) or {}
-        dates_raw = ext.get("dates", {}) or {}
-        parties_raw = ext.get("parties") or []
-        
-        # Безопасное создание parties
-        parties_list = []
-        for p in parties_raw:
-            if isinstance(p, dict):
-                try:
-                    parties_list.append(Party(**p))
-                except Exception as e:
-                    logger.warning(f"Error parsing party: {e}")
-                    parties_list.append(Party(name=str(p.get("name", "Unknown")), role=p.get("role", "other")))
-            else:
-                parties_list.append(Party(name=str(p), role="other"))
+    
+    def _parse_json(self, response: str) -> Optional[dict]:
+        """JSON из ответа модели: markdown снимается, оборванный ответ восстанавливается до целых полей"""
+        recovered = recover_json(response)
+        if recovered.data is None:
+            logger.warning("JSON parse error: в ответе модели нет разбираемого JSON")
+        return recovered.data if isinstance(recovered.data, dict) else None
+    
+    async def _recover_json(self, prompt: str, response: str, user_id=None) -> Tuple[Optional[dict], bool]:
+        """Разбор ответа; если он оборвался на maxTokens — дописываем коротким вызовом-продолжением
+
+        Второе значение — ответ получен целиком (спасённые обрывки и неудачи не кэшируются).
+        """
+        recovered = recover_json(response)
+        if not recovered.truncated:
+            if not isinstance(recovered.data, dict):
+                _json_recovery["failed"] += 1
+                logger.warning("JSON parse error: в ответе модели нет разбираемого JSON")
+                return None, False
+            return recovered.data, True
         
-        # Безопасное создание risk_flags
-        risk_flags_list = []
-        for f in (data.get("risk_flags") or []):
+        _json_recovery["truncated"] += 1
+        if CONTINUATION_MAX_TOKENS > 0:
             try:
-                level_str = f.get("level", "low").lower()
-                # ✅ Преобразуем уровень риска в Enum
-                if level_str not in ["low", "medium", "high", "critical"]:
-                    level_str = "low"
-                risk_flags_list.append(RiskFlag(
-                    level=RiskLevel(level_str),
-                    category=f.get("category", "other"),
-                    title=f.get("title"),
-                    description=f.get("description", ""),
-                    legal_basis=f.get("legal_basis"),
-                    suggestion=f.get("suggestion", ""),
-                    impact=f.get("impact")
-                ))
+                tail = await self.gpt.call_gpt(
+                    prompt, max_tokens=CONTINUATION_MAX_TOKENS, user_id=user_id, continue_from=response
+                )
+                tail = strip_code_fences(tail).lstrip()
+                # Модель могла начать ответ заново, а не продолжить
+                continued = recover_json(tail if tail.startswith("{") else response + tail)
+                if not continued.truncated and isinstance(continued.data, dict):
+                    _json_recovery["continued"] += 1
+                    logger.info("✂️ Ответ модели оборвался — дописан продолжением")
+                    return continued.data, True
             except Exception as e:
-                logger.warning(f"Error parsing risk flag: {e}")
-        
-        # Безопасное создание action_items
-        action_items_list = []
-        for a in (data.get("action_items") or []):
-            if isinstance(a, dict):
-                try:
-                    action_items_list.append(ActionItem(**a))
-                except Exception as e:
-                    logger.warning(f"Error parsing action item: {e}")
-                    action_items_list.append(ActionItem(action=str(a.get("action", "Check manually"))))
-            else:
-                action_items_list.append(ActionItem(action=str(a)))
-        
-        result = AnalysisResult(
-            extracted_data=ExtractedData(
-                document_type=DocumentType(ext.get("document_type", "other")),
-                document_subtype=ext.get("document_subtype", "other"),
-                document_number=ext.get("document_number"),
-                document_date=ext.get("document_date"),
-                parties=parties_list,
-                financial_terms=FinancialTerms(
-                    total_amount=financial_raw.get("total_amount"),
-                    currency=financial_raw.get("currency", "RUB"),
-                    interest_rate=financial_raw.get("interest_rate"),
-                    interest_rate_numeric=financial_raw.get("interest_rate_numeric"),
-                    payment_schedule=financial_raw.get("payment_schedule"),
-                    loan_term_days=financial_raw.get("loan_term_days"),
-                    late_fee_percent=financial_raw.get("late_fee_percent"),
-                    late_fee_description=financial_raw.get("late_fee_description"),
-                ),
-                dates=DatesData(
-                    signature=dates_raw.get("signature"),
-                    start_date=dates_raw.get("start_date"),
-                    end_date=dates_raw.get("end_date"),
-                    payment_due=dates_raw.get("payment_due"),
-                ),
-                obligations=ext.get("obligations") or [],
-                penalties=ext.get("penalties"),
-                termination_conditions=ext.get("termination_conditions"),
-                dispute_resolution=ext.get("dispute_resolution"),
-                missing_requisites=ext.get("missing_requisites", []),
-            ),
-            risk_flags=risk_flags_list,
-            action_items=action_items_list,
-            summary=data.get("summary", "Анализ завершён"),
-            confidence_score=min(1.0, max(0.0, data.get("confidence_score", 0.5))),
-            analysis_notes=data.get("analysis_notes")
-        )
+                logger.warning(f"⚠️ Продолжение оборванного ответа не удалось: {e}")
         
-        _analysis_cache[text_hash] = result
+        if isinstance(recovered.data, dict):
+            _json_recovery["salvaged"] += 1
+            logger.warning("✂️ Ответ модели оборвался — используем целые поля")
+            data = recovered.data
+            note = "Ответ модели оборвался: часть полей может отсутствовать."
+            data["analysis_notes"] = "\n".join(filter(None, [data.get("analysis_notes"), note]))
+            return data, False
+        _json_recovery["failed"] += 1
+        return None, False
+    
+    def parse_response(self, response: str) -> AnalysisResult:
+        """Разбирает JSON-ответ модели и собирает AnalysisResult"""
+        return self.result_from_data(self._parse_json(response))
+    
+    def result_from_data(self, data: Optional[dict], complete: bool = True) -> AnalysisResult:
+        """AnalysisResult из разобранного JSON; без данных — заглушка «проверить вручную»"""
+        if data is not None:
+            try:
+                result = self.assemble_result(data)
+                result._cacheable = complete
+                return result
+            except ValidationError as e:
+                logger.warning(f"Ответ модели не соответствует схеме: {e}")
+        fallback = self.assemble_result({
+            "extracted_data": {"document_type": "other"},
+            "action_items": ["Проверить документ вручную"],
+            "summary": "Не удалось проанализировать документ",
+            "confidence_score": 0.3
+        })
+        fallback._cacheable = False
+        return fallback
+    
+    def assemble_result(self, data: dict) -> AnalysisResult:
+        """Один проход валидации по схеме: типы приводятся мягко, битые элементы списков отбрасываются"""
+        return _RESULT_ADAPTER.validate_python(data)
+    
+    async def _remember(self, cache_key: str, text_hash: str, result: AnalysisResult):
+        if not result._cacheable:
+            # Иначе один неудачный ответ модели закрепится за документом для всех пользователей
+            logger.info("⏭️ Неполный результат анализа не кэшируется")
+            return
+        _analysis_cache.set(cache_key, result)
         logger.info(f"💾 Результат сохранён в кэш (всего: {len(_analysis_cache)})")
-        return result
+        if PERSISTENT_CACHE_ENABLED:
+            await self._store_persisted(cache_key, text_hash, result)
+    
+    async def _load_persisted(self, cache_key: str) -> Optional[AnalysisResult]:
+        async with AsyncSessionLocal() as db:
+            try:
+                entry = await db.get(AnalysisCacheEntry, cache_key)
+                if entry is None:
+                    return None
+                result = _RESULT_ADAPTER.validate_json(entry.result)
+                entry.hit_count = (entry.hit_count or 0) + 1
+                entry.last_used_at = datetime.utcnow()
+                await db.commit()
+                return result
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка чтения персистентного кэша: {e}")
+                await db.rollback()
+                return None
+    
+    async def _store_persisted(self, cache_key: str, text_hash: str, result: AnalysisResult):
+        async with AsyncSessionLocal() as db:
+            try:
+                db.add(AnalysisCacheEntry(
+                    cache_key=cache_key,
+                    content_hash=text_hash,
+                    prompt_version=PROMPT_VERSION,
+                    model_uri=self.gpt.model_uri,
+                    result=_RESULT_ADAPTER.dump_json(result).decode(),
+                ))
+                await db.commit()
+            except IntegrityError:
+                # Другой воркер уже сохранил этот же результат
+                await db.rollback()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка записи персистентного кэша: {e}")
+                await db.rollback()
+
+# ==================== СОХРАНЕНИЕ ====================
+def history_entry(filename: str, result: AnalysisResult, user_id: Optional[int]) -> AnalysisHistory:
+    return AnalysisHistory(
+        filename=filename,
+        document_type=result.extracted_data.document_type.value,
+        parties=", ".join(p.name for p in result.extracted_data.parties),
+        total_amount=result.extracted_data.financial_terms.total_amount,
+        currency=result.extracted_data.financial_terms.currency,
+        summary=result.summary,
+        confidence_score=result.confidence_score,
+        risk_count=len(result.risk_flags),
+        result_json=_RESULT_ADAPTER.dump_json(result),
+        user_id=user_id
+    )
+
+async def save_analysis(db: AsyncSession, filename: str, result: AnalysisResult, user_id: Optional[int]) -> AnalysisHistory:
+    """Сохраняет результат анализа в историю пользователя"""
+    history = history_entry(filename, result, user_id)
+    db.add(history)
+    await bump_user_stats(db, user_id, [history])
+    await db.commit()
+    return history
 
 # ==================== FASTAPI APP ====================
 app = FastAPI(title="DocuBot API", description="AI-агент для анализа документов", version="0.3.1")
 
+# Тело запроса больше лимита отклоняется до чтения (запас на multipart-заголовки).
+# Добавляется раньше CORS: последний добавленный middleware внешний, и 413 тоже получает CORS-заголовки
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES + 64 * 1024,
+    overrides={"/api/analyze/batch": MAX_BATCH_BYTES + 1024 * 1024},
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -453,7 +906,90 @@ logger.info("✅ Database initialized")
 
 FOLDER_ID = os.getenv("YANDEX_FOLDER_ID", "b1gdcuaq0il54iojm93b")
 gpt_service = YandexGPTService(FOLDER_ID)
-agent = DocumentAgent(gpt_service)
+pdf_extractor = PDFExtractor(
+    workers=int(os.getenv("PDF_WORKERS", min(4, os.cpu_count() or 1))),
+    timeout=float(os.getenv("PDF_EXTRACT_TIMEOUT", 20)),
+    max_pages=PDF_MAX_PAGES,
+    max_chars=PDF_MAX_CHARS,
+)
+agent = DocumentAgent(gpt_service, pdf_extractor)
+
+# ==================== ФОНОВЫЕ ЗАДАЧИ ====================
+async def persist_analysis(filename: str, result: AnalysisResult, user_id: Optional[int]) -> int:
+    """Сохранение вне HTTP-зависимостей (фоновые задачи, стриминг): своя сессия БД"""
+    async with AsyncSessionLocal() as db:
+        return (await save_analysis(db, filename, result, user_id)).id
+
+async def persist_analyses(items: List[Tuple[str, AnalysisResult]], user_id: Optional[int]) -> List[int]:
+    """Пакетное сохранение: все записи одним INSERT и одним коммитом"""
+    if not items:
+        return []
+    async with AsyncSessionLocal() as db:
+        entries = [history_entry(filename, result, user_id) for filename, result in items]
+        db.add_all(entries)
+        await bump_user_stats(db, user_id, entries)
+        await db.commit()
+        return [entry.id for entry in entries]
+
+async def run_analysis_job(job: Job) -> dict:
+    with job.payload as upload:
+        result = await agent.analyze_upload(upload, on_stage=job.emit, user_id=job.user_id)
+    analysis_id = await persist_analysis(job.filename, result, job.user_id)
+    job.emit("persisted", {"analysis_id": analysis_id})
+    return {"analysis_id": analysis_id, "result": result.model_dump(mode="json")}
+
+job_manager = JobManager(
+    run_analysis_job,
+    workers=int(os.getenv("JOB_WORKERS", 4)),
+    max_queue=int(os.getenv("JOB_QUEUE_SIZE", 100)),
+    ttl_seconds=float(os.getenv("JOB_TTL_SECONDS", 3600)),
+)
+
+# ==================== ОЧИСТКА ПЕРСИСТЕНТНОГО КЭША ====================
+_persistent_pruned = {"runs": 0, "deleted": 0}
+_prune_task: Optional[asyncio.Task] = None
+
+async def prune_persistent_cache() -> int:
+    """Удаляет записи analysis_cache, которые не читались дольше PERSISTENT_CACHE_TTL_DAYS"""
+    cutoff = datetime.utcnow() - timedelta(days=PERSISTENT_CACHE_TTL_DAYS)
+    async with AsyncSessionLocal() as db:
+        deleted = (await db.execute(
+            delete(AnalysisCacheEntry).where(AnalysisCacheEntry.last_used_at < cutoff)
+        )).rowcount
+        await db.commit()
+    _persistent_pruned["runs"] += 1
+    _persistent_pruned["deleted"] += deleted
+    if deleted:
+        logger.info(f"🧹 Персистентный кэш: удалено устаревших записей: {deleted}")
+    return deleted
+
+async def _prune_loop() -> None:
+    while True:
+        try:
+            await prune_persistent_cache()
+        except Exception as e:
+            logger.warning(f"⚠️ Очистка персистентного кэша: {e}")
+        await asyncio.sleep(PERSISTENT_CACHE_PRUNE_INTERVAL)
+
+@app.on_event("startup")
+async def startup():
+    global _prune_task
+    # Токен получаем заранее, чтобы первый запрос не ждал IAM
+    await gpt_service.tokens.start()
+    await job_manager.start()
+    if PERSISTENT_CACHE_ENABLED and PERSISTENT_CACHE_TTL_DAYS > 0:
+        _prune_task = asyncio.create_task(_prune_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _prune_task is not None:
+        _prune_task.cancel()
+        await asyncio.gather(_prune_task, return_exceptions=True)
+    await job_manager.stop()
+    await gpt_service.tokens.stop()
+    await gpt_service.aclose()
+    pdf_extractor.shutdown()
+    await async_engine.dispose()
 
 # ==================== PUBLIC ENDPOINTS ====================
 @app.get("/")
@@ -462,31 +998,57 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    breaker = gpt_service.breaker.snapshot()
+    return {
+        "status": "ok" if breaker["state"] == "closed" else "degraded",
+        "gpt": breaker,
+        "jobs": job_manager.stats(),
+    }
 
 @app.get("/cache/stats")
 async def cache_stats():
-    return {"cache_size": len(_analysis_cache), "cache_info": get_text_hash.cache_info()}
+    return {
+        "cache_size": len(_analysis_cache),
+        "analysis_cache": _analysis_cache.stats(),
+        "upload_cache": _upload_cache.stats(),
+        "in_flight": _inflight_analyses.stats(),
+        "compaction": _compaction_totals,
+        "persistent": {
+            "enabled": PERSISTENT_CACHE_ENABLED,
+            "ttl_days": PERSISTENT_CACHE_TTL_DAYS,
+            **_persistent_pruned,
+        },
+    }
+
+@app.get("/gpt/stats")
+async def gpt_stats():
+    """Квота GPT: очередь допуска, время ожидания, circuit breaker и IAM-токен"""
+    return {
+        "admission": gpt_service.limiter.stats(),
+        "json_recovery": _json_recovery,
+        "breaker": gpt_service.breaker.snapshot(),
+        "iam_token": gpt_service.tokens.stats(),
+    }
 
 # ==================== AUTH ENDPOINTS ====================
 @app.post("/auth/register", response_model=UserResponse)
-async def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
     """Регистрация нового пользователя"""
-    db_user = get_user(db, email=user.email)
+    db_user = await get_user(db, email=user.email)
     if db_user:
         raise HTTPException(
             status_code=400,
             detail="Email уже зарегистрирован"
         )
     
-    new_user = create_user(db=db, user=user)
+    new_user = await create_user(db=db, user=user)
     logger.info(f"✅ Новый пользователь: {new_user.email}")
     return new_user
 
 @app.post("/auth/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """Вход пользователя"""
-    user = get_user(db, email=form_data.username)
+    user = await get_user(db, email=form_data.username)
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -516,53 +1078,270 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 @app.post("/api/analyze", response_model=DocumentUploadResponse)
 async def analyze_document(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     logger.info(f"📁 Анализ от пользователя: {current_user.email}, файл: {file.filename}")
     try:
-        content = await file.read()
-        text = agent.extract_text_from_pdf(content)
-        if not text or len(text) < 10:
-            raise HTTPException(400, "Не удалось извлечь текст")
-        
-        result = agent.analyze_document(text)
+        with await spool_upload(file, MAX_UPLOAD_BYTES) as upload:
+            try:
+                result = await agent.analyze_upload(upload, user_id=current_user.id)
+            except DocumentTextError as e:
+                raise HTTPException(400, str(e))
         
+        # Короткая своя сессия: соединение из пула берётся только на время записи
         try:
-            history = AnalysisHistory(
-                filename=file.filename,
-                document_type=result.extracted_data.document_type.value,
-                parties=str(result.extracted_data.parties),
-                total_amount=result.extracted_data.total_amount,
-                currency=result.extracted_data.currency,
-                summary=result.summary,
-                confidence_score=result.confidence_score,
-                risk_count=len(result.risk_flags),
-                full_result=json.dumps(result.model_dump()),
-                user_id=str(current_user.id)
-            )
-            db.add(history)
-            db.commit()
+            await persist_analysis(file.filename, result, current_user.id)
         except Exception as e:
             logger.error(f"❌ Ошибка сохранения в БД: {e}")
-            db.rollback()
         
         return DocumentUploadResponse(status="success", result=result)
     except HTTPException:
         raise
+    except CircuitOpenError as e:
+        retry_in = gpt_service.breaker.snapshot()["retry_in"] or GPT_BREAKER_RECOVERY
+        raise HTTPException(503, str(e), headers={"Retry-After": str(int(retry_in) + 1)})
+    except AdmissionQueueFullError as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Ошибка: {str(e)}")
         return DocumentUploadResponse(status="error", error=str(e))
 
+@app.post("/api/analyze/stream")
+async def analyze_document_stream(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """SSE: фрагменты ответа модели по мере генерации, затем итоговый результат"""
+    filename = file.filename
+    # Файл нужен только до извлечения текста
+    with await spool_upload(file, MAX_UPLOAD_BYTES) as upload:
+        try:
+            prepared = await agent.prepare_upload(upload)
+        except DocumentTextError as e:
+            raise HTTPException(400, str(e))
+    logger.info(f"📡 Потоковый анализ от {current_user.email}, файл: {filename}")
+    
+    async def stream():
+        yield sse_event("extracted", prepared.extracted_event())
+        try:
+            result = prepared.result
+            if result is None:
+                async for event, data in agent.stream_analysis(prepared.text, user_id=current_user.id):
+                    if event == "result":
+                        result = data
+                    else:
+                        yield sse_event(event, data)
+                if result._cacheable:
+                    _upload_cache.set(prepared.upload_hash, (prepared.text, result))
+            try:
+                analysis_id = await persist_analysis(filename, result, current_user.id)
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения в БД: {e}")
+                analysis_id = None
+            yield sse_event("result", {
+                "status": "success",
+                "analysis_id": analysis_id,
+                "result": result.model_dump(mode="json")
+            })
+        except Exception as e:
+            logger.error(f"Ошибка потокового анализа: {e}")
+            yield sse_event("error", {"status": "error", "error": str(e)})
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _spool_batch(files: List[UploadFile]) -> List[SpooledUpload]:
+    """Все файлы пакета на диск (ZIP распаковывается) до начала ответа"""
+    uploads: List[SpooledUpload] = []
+    total = 0
+    try:
+        for file in files:
+            upload = await spool_upload(file, MAX_BATCH_BYTES - total)
+            total += upload.size
+            if await asyncio.to_thread(zipfile.is_zipfile, upload.path):
+                with upload:
+                    uploads.extend(await asyncio.to_thread(
+                        unpack_zip,
+                        upload,
+                        max_files=MAX_BATCH_FILES - len(uploads),
+                        max_file_bytes=MAX_UPLOAD_BYTES,
+                        max_total_bytes=MAX_BATCH_BYTES,
+                    ))
+            elif upload.size > MAX_UPLOAD_BYTES:
+                upload.cleanup()
+                raise HTTPException(413, f"{file.filename}: файл больше {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+            else:
+                uploads.append(upload)
+            if len(uploads) > MAX_BATCH_FILES:
+                raise HTTPException(400, f"В пакете больше {MAX_BATCH_FILES} файлов")
+    except BaseException:
+        for upload in uploads:
+            upload.cleanup()
+        raise
+    if not uploads:
+        raise HTTPException(400, "В пакете нет PDF-файлов")
+    return uploads
+
+@app.post("/api/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Пакетный анализ PDF-файлов или ZIP-архива: NDJSON, по строке на документ по мере готовности"""
+    uploads = await _spool_batch(files)
+    user_id = current_user.id
+    logger.info(f"📦 Пакет от {current_user.email}: {len(uploads)} файлов")
+    
+    async def analyze_one(index: int, upload: SpooledUpload, gpt_slots) -> dict:
+        line = {"index": index, "filename": upload.filename}
+        try:
+            # Очередь к пулу процессов держит сам pdf_extractor
+            with upload:
+                prepared = await agent.prepare_upload(upload)
+            async with gpt_slots:
+                result = await agent.analyze_prepared(prepared, user_id=user_id)
+            return {**line, "status": "success", "result": result}
+        except Exception as e:
+            logger.warning(f"⚠️ Пакет: {upload.filename}: {e}")
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            return {**line, "status": "error", "error": error}
+    
+    async def stream():
+        gpt_slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(analyze_one(i, upload, gpt_slots))
+            for i, upload in enumerate(uploads)
+        ]
+        completed: List[Tuple[str, AnalysisResult]] = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                if line["status"] == "success":
+                    completed.append((line["filename"], line["result"]))
+                    line["result"] = line["result"].model_dump(mode="json")
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            
+            summary = {"status": "done", "total": len(uploads), "succeeded": len(completed)}
+            try:
+                summary["analysis_ids"] = await persist_analyses(completed, user_id)
+            except Exception as e:
+                logger.error(f"❌ Ошибка пакетного сохранения в БД: {e}")
+                summary["error"] = "Результаты не сохранены в историю"
+            yield json.dumps(summary, ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился — останавливаем оставшиеся анализы и удаляем файлы
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for upload in uploads:
+                upload.cleanup()
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# ==================== JOBS API ====================
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    file: UploadFile = File(...),
+    current_user: User = Depends(get_current_user)
+):
+    """Ставит документ в очередь анализа и сразу возвращает id задачи"""
+    upload = await spool_upload(file, MAX_UPLOAD_BYTES)
+    try:
+        job = job_manager.submit(current_user.id, file.filename, upload)
+    except JobQueueFullError as e:
+        upload.cleanup()
+        raise HTTPException(503, str(e))
+    logger.info(f"📥 Задача {job.id} от {current_user.email}: {file.filename}")
+    return {
+        "status": "accepted",
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+    }
+
+def _get_user_job(job_id: str, current_user: User) -> Job:
+    job = job_manager.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    return _get_user_job(job_id, current_user).to_dict()
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, current_user: User = Depends(get_current_user)):
+    """SSE-поток этапов: extracted, gpt_started, parsed, persisted, затем done/error"""
+    job = _get_user_job(job_id, current_user)
+    
+    async def stream():
+        async for event in job.follow():
+            yield sse_event(event["stage"], event)
+        yield sse_event("result", {"status": job.status, "result": job.result, "error": job.error})
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+HISTORY_MAX_LIMIT = 100
+
+def _encode_cursor(created_at: datetime, analysis_id: int) -> str:
+    """Непрозрачный курсор: позиция последней записи страницы"""
+    raw = json.dumps([created_at.isoformat(), analysis_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, analysis_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(analysis_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Неверный cursor")
+
 @app.get("/api/history")
-async def get_history(limit: int = 10, skip: int = 0, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_history(
+    limit: int = 10,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+):
+    """История анализов по страницам: следующая страница — по next_cursor (skip оставлен для совместимости)"""
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    position = _decode_cursor(cursor) if cursor else None
     try:
-        analyses = db.query(AnalysisHistory).filter(
-            AnalysisHistory.user_id == str(current_user.id)
-        ).order_by(desc(AnalysisHistory.created_at)).offset(skip).limit(limit).all()
+        # Только колонки списка: без full_result и summary
+        query = select(
+            AnalysisHistory.id,
+            AnalysisHistory.filename,
+            AnalysisHistory.document_type,
+            AnalysisHistory.created_at,
+            AnalysisHistory.confidence_score,
+            AnalysisHistory.risk_count,
+        ).where(AnalysisHistory.user_id == current_user.id)
+        if position is not None:
+            # Keyset: продолжаем после последней записи, страница N стоит столько же, сколько первая
+            created_at, last_id = position
+            query = query.where(or_(
+                AnalysisHistory.created_at < created_at,
+                and_(AnalysisHistory.created_at == created_at, AnalysisHistory.id < last_id),
+            ))
+        query = query.order_by(desc(AnalysisHistory.created_at), desc(AnalysisHistory.id))
+        if position is None and skip:
+            query = query.offset(skip)
+        rows = (await db.execute(query.limit(limit + 1))).all()
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
         return {
             "status": "success",
-            "count": len(analyses),
+            "count": len(rows),
+            "next_cursor": _encode_cursor(rows[-1].created_at, rows[-1].id) if has_more else None,
             "analyses": [
                 {
                     "id": a.id,
@@ -571,7 +1350,7 @@ async def get_history(limit: int = 10, skip: int = 0, db: Session = Depends(get_
                     "created_at": a.created_at.isoformat(),
                     "confidence_score": a.confidence_score,
                     "risk_count": a.risk_count
-                } for a in analyses
+                } for a in rows
             ]
         }
     except Exception as e:
@@ -579,51 +1358,30 @@ async def get_history(limit: int = 10, skip: int = 0, db: Session = Depends(get_
         return {"status": "error", "error": str(e)}
 
 @app.get("/api/stats")
-async def get_stats(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_stats(db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    """Статистика пользователя: одна строка user_stats по первичному ключу"""
     try:
-        base_query = db.query(AnalysisHistory).filter(AnalysisHistory.user_id == str(current_user.id))
-        total_documents = base_query.count()
-        contracts = base_query.filter(AnalysisHistory.document_type == "contract").count()
-        invoices = base_query.filter(AnalysisHistory.document_type == "invoice").count()
-        acts = base_query.filter(AnalysisHistory.document_type == "act").count()
-        avg_confidence = db.query(func.avg(AnalysisHistory.confidence_score)).filter(
-            AnalysisHistory.user_id == str(current_user.id)
-        ).scalar() or 0
-        total_risks = db.query(func.sum(AnalysisHistory.risk_count)).filter(
-            AnalysisHistory.user_id == str(current_user.id)
-        ).scalar() or 0
-        
+        stats = await db.get(UserStats, current_user.id) or await rebuild_user_stats(db, current_user.id)
         return {
             "status": "success",
-            "total_documents": total_documents,
+            "total_documents": stats.total_documents,
             "by_type": {
-                "contract": contracts,
-                "invoice": invoices,
-                "act": acts,
-                "other": total_documents - contracts - invoices - acts
+                "contract": stats.contracts,
+                "invoice": stats.invoices,
+                "act": stats.acts,
+                "other": stats.total_documents - stats.contracts - stats.invoices - stats.acts
             },
-            "avg_confidence": round(avg_confidence, 2),
-            "total_risks": total_risks
+            "avg_confidence": round(stats.avg_confidence, 2),
+            "total_risks": stats.total_risks
         }
     except Exception as e:
         logger.error(f"Error fetching stats: {e}")
         return {"status": "error", "error": str(e)}
 
 # ==================== PDF GENERATION ====================
-@app.get("/api/generate-pdf/{analysis_id}")
-async def generate_pdf(analysis_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    """Генерация PDF отчёта с поддержкой кириллицы"""
-    
-    analysis = db.query(AnalysisHistory).filter(
-        AnalysisHistory.id == analysis_id,
-        AnalysisHistory.user_id == str(current_user.id)
-    ).first()
-    
-    if not analysis:
-        raise HTTPException(404, "Analysis not found")
-
+def render_report_pdf(full_result: dict) -> BytesIO:
+    """PDF-отчёт по сохранённому результату анализа (reportlab)"""
     # 🔧 РЕГИСТРАЦИЯ ШРИФТОВ (Windows + Linux)
-    import sys
     main_font = 'Helvetica'
     bold_font = 'Helvetica-Bold'
     
@@ -670,21 +1428,17 @@ async def generate_pdf(analysis_id: int, db: Session = Depends(get_db), current_
     y -= 30
     p.setFont(main_font, 11)
 
-    # Парсинг full_result
-    try:
-        full_result = json.loads(analysis.full_result) if isinstance(analysis.full_result, str) else analysis.full_result
-    except:
-        full_result = {}
-    
     ext = full_result.get('extracted_data', {})
     
     p.drawString(50, y, f"Тип: {ext.get('document_type', 'N/A')}")
     y -= 20
     parties = ext.get('parties', [])
-    parties_str = ', '.join(parties) if isinstance(parties, list) and parties else 'N/A'
+    party_names = [p_.get('name', '') if isinstance(p_, dict) else str(p_) for p_ in parties or []]
+    parties_str = ', '.join(filter(None, party_names)) or 'N/A'
     p.drawString(50, y, f"Стороны: {parties_str}")
     y -= 20
-    p.drawString(50, y, f"Сумма: {ext.get('total_amount', 'N/A')} {ext.get('currency', '')}")
+    finance = ext.get('financial_terms') or {}
+    p.drawString(50, y, f"Сумма: {finance.get('total_amount') or 'N/A'} {finance.get('currency') or ''}")
     y -= 50
 
     # Риски
@@ -736,6 +1490,31 @@ async def generate_pdf(analysis_id: int, db: Session = Depends(get_db), current_
     p.save()
     buffer.seek(0)
     
+    return buffer
+
+@app.get("/api/generate-pdf/{analysis_id}")
+async def generate_pdf(analysis_id: int, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user)):
+    """Генерация PDF отчёта с поддержкой кириллицы"""
+    
+    # Отложенные колонки full_result загружаем сразу: ленивой подгрузки в async-сессии нет
+    analysis = (await db.execute(
+        select(AnalysisHistory)
+        .options(undefer_group("full_result"))
+        .where(AnalysisHistory.id == analysis_id, AnalysisHistory.user_id == current_user.id)
+    )).scalars().first()
+    
+    if not analysis:
+        raise HTTPException(404, "Analysis not found")
+
+    # Полный результат (сжатый или старый текстовый формат)
+    try:
+        full_result = analysis.result_data
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось прочитать результат анализа {analysis_id}: {e}")
+        full_result = {}
+    
+    buffer = render_report_pdf(full_result)
+    
     return StreamingResponse(
         buffer,
         media_type="application/pdf",
@@ -0,0 +1,78 @@
+# migrate_full_result.py
+"""Разовая миграция: AnalysisHistory.full_result (текст json.dumps) -> full_result_blob (сжатый JSON)
+
+Запуск из папки backend (DATABASE_URL — как у приложения):
+    python migrate_full_result.py --dry-run
+    python migrate_full_result.py --batch-size 500
+Повторный запуск безопасен: обрабатываются только строки, ещё не переведённые в новый формат.
+"""
+import json
+import argparse
+
+from sqlalchemy import select
+
+from database import AnalysisHistory, SessionLocal, engine, init_db, pack_result
+
+
+def migrate(batch_size: int, dry_run: bool) -> dict:
+    stats = {"rows": 0, "broken": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = 0
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(AnalysisHistory.id, AnalysisHistory.full_result)
+                .where(AnalysisHistory.id > last_id)
+                .where(AnalysisHistory.full_result.is_not(None))
+                .where(AnalysisHistory.full_result_blob.is_(None))
+                .order_by(AnalysisHistory.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for row_id, full_result in rows:
+                last_id = row_id
+                try:
+                    # Перекодируем без \\u-экранирования кириллицы: так ещё и сжимается лучше
+                    payload = json.dumps(json.loads(full_result), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                except ValueError:
+                    stats["broken"] += 1
+                    payload = full_result.encode("utf-8")
+                blob = pack_result(payload)
+                stats["rows"] += 1
+                stats["bytes_before"] += len(full_result.encode("utf-8"))
+                stats["bytes_after"] += len(blob)
+                if not dry_run:
+                    db.query(AnalysisHistory).filter(AnalysisHistory.id == row_id).update(
+                        {AnalysisHistory.full_result_blob: blob, AnalysisHistory.full_result: None},
+                        synchronize_session=False,
+                    )
+            if not dry_run:
+                db.commit()
+            print(f"… обработано строк: {stats['rows']} (id до {last_id})")
+        finally:
+            db.close()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Перевод full_result в сжатый формат")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать экономию, ничего не менять")
+    args = parser.parse_args()
+
+    # Применяет миграции схемы, в том числе добавление колонки full_result_blob
+    init_db()
+    stats = migrate(args.batch_size, args.dry_run)
+    if stats["bytes_before"]:
+        ratio = stats["bytes_before"] / max(1, stats["bytes_after"])
+        print(f"✅ Строк: {stats['rows']}, битых JSON: {stats['broken']}, "
+              f"{stats['bytes_before']} -> {stats['bytes_after']} байт (в {ratio:.1f} раза меньше)")
+    else:
+        print("✅ Переносить нечего")
+    if not args.dry_run and stats["rows"] and engine.dialect.name == "postgresql":
+        print("ℹ️ Место на диске освободится после VACUUM analysis_history")
+
+
+if __name__ == "__main__":
+    main()
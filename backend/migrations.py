@@ -0,0 +1,157 @@
+# migrations.py
+"""Версионированные миграции схемы БД
+
+В таблице schema_version хранятся номера применённых миграций. Каждая миграция применяется
+в своей транзакции вместе с записью о ней; на PostgreSQL воркеры, стартующие одновременно,
+ждут друг друга на advisory-lock. Новая миграция — функция upgrade(conn) и строка в MIGRATIONS.
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from database import Base, AnalysisCacheEntry, STATS_COUNTERS, User, UserStats, engine, user_stats_query
+
+# Произвольный ключ advisory-lock для миграций
+MIGRATION_LOCK_ID = 824051
+
+# ==================== МИГРАЦИИ ====================
+def _create_base_tables(conn: Connection) -> None:
+    """Таблицы, которые раньше создавал create_all, — если их ещё нет"""
+    Base.metadata.create_all(conn, tables=[User.__table__, AnalysisCacheEntry.__table__])
+
+def _add_full_result_blob(conn: Connection) -> None:
+    """Сжатый полный результат (раньше добавлялся при старте в init_db)"""
+    columns = {c["name"] for c in inspect(conn).get_columns("analysis_history")}
+    if "full_result_blob" not in columns:
+        blob_type = "BYTEA" if conn.dialect.name == "postgresql" else "BLOB"
+        conn.execute(text(f"ALTER TABLE analysis_history ADD COLUMN full_result_blob {blob_type}"))
+
+def _history_user_fk(conn: Connection) -> None:
+    """analysis_history.user_id: строка -> INTEGER REFERENCES users(id) + индекс (user_id, created_at)
+
+    Значения, не соответствующие ни одному пользователю ("web", "bench" и т.п.), становятся NULL.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("DROP INDEX IF EXISTS ix_analysis_history_user_created"))
+        conn.execute(text("ALTER TABLE analysis_history ALTER COLUMN user_id DROP DEFAULT"))
+        conn.execute(text(
+            "UPDATE analysis_history SET user_id = NULL "
+            "WHERE user_id IS NOT NULL AND user_id NOT IN (SELECT CAST(id AS VARCHAR) FROM users)"
+        ))
+        conn.execute(text("ALTER TABLE analysis_history ALTER COLUMN user_id TYPE INTEGER USING user_id::integer"))
+        conn.execute(text(
+            "ALTER TABLE analysis_history ADD CONSTRAINT analysis_history_user_id_fkey "
+            "FOREIGN KEY (user_id) REFERENCES users (id)"
+        ))
+    else:
+        # SQLite не меняет тип колонки через ALTER — пересобираем таблицу
+        conn.execute(text("DROP TABLE IF EXISTS analysis_history_new"))
+        conn.execute(text("""
+            CREATE TABLE analysis_history_new (
+                id INTEGER NOT NULL PRIMARY KEY,
+                filename VARCHAR NOT NULL,
+                document_type VARCHAR NOT NULL,
+                parties VARCHAR,
+                total_amount FLOAT,
+                currency VARCHAR,
+                summary TEXT,
+                confidence_score FLOAT,
+                risk_count INTEGER,
+                full_result TEXT,
+                full_result_blob BLOB,
+                user_id INTEGER REFERENCES users (id),
+                created_at DATETIME
+            )
+        """))
+        conn.execute(text("""
+            INSERT INTO analysis_history_new
+            SELECT id, filename, document_type, parties, total_amount, currency, summary,
+                   confidence_score, risk_count, full_result, full_result_blob,
+                   CASE WHEN user_id IN (SELECT CAST(id AS TEXT) FROM users) THEN CAST(user_id AS INTEGER) END,
+                   created_at
+            FROM analysis_history
+        """))
+        conn.execute(text("DROP TABLE analysis_history"))
+        conn.execute(text("ALTER TABLE analysis_history_new RENAME TO analysis_history"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_analysis_history_id ON analysis_history (id)"))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_analysis_history_user_created "
+        "ON analysis_history (user_id, created_at, id)"
+    ))
+
+def _user_stats(conn: Connection) -> None:
+    """Таблица счётчиков для /api/stats, заполненная по существующей истории"""
+    UserStats.__table__.create(conn, checkfirst=True)
+    conn.execute(text("DELETE FROM user_stats"))
+    columns = [UserStats.user_id] + [getattr(UserStats, name) for name in STATS_COUNTERS]
+    conn.execute(UserStats.__table__.insert().from_select(columns, user_stats_query()))
+
+def _analysis_cache_last_used_index(conn: Connection) -> None:
+    """Индекс для удаления устаревших записей персистентного кэша"""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_analysis_cache_last_used_at ON analysis_cache (last_used_at)"
+    ))
+
+# (номер, название, функция) — номера только растут, применённые миграции не меняются
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "base_tables", _create_base_tables),
+    (2, "full_result_blob", _add_full_result_blob),
+    (3, "history_user_fk", _history_user_fk),
+    (4, "user_stats", _user_stats),
+    (5, "analysis_cache_last_used_index", _analysis_cache_last_used_index),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ==================== ПРИМЕНЕНИЕ ====================
+def _lock(conn: Connection) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+def _applied_version(conn: Connection) -> int:
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+def _record(conn: Connection, version: int, name: str) -> None:
+    conn.execute(
+        text("INSERT INTO schema_version (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+        {"version": version, "name": name, "applied_at": datetime.utcnow()},
+    )
+
+def current_version() -> int:
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_version"):
+            return 0
+        return _applied_version(conn)
+
+def run_migrations() -> List[str]:
+    """Применяет недостающие миграции, возвращает названия применённых"""
+    with engine.begin() as conn:
+        _lock(conn)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER NOT NULL PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+        if _applied_version(conn) == 0 and not inspect(conn).has_table("analysis_history"):
+            # Пустая БД: схема сразу в актуальном виде, все миграции считаются применёнными
+            Base.metadata.create_all(conn)
+            for version, name, _ in MIGRATIONS:
+                _record(conn, version, name)
+            return ["create_all"]
+
+    applied = []
+    for version, name, upgrade in MIGRATIONS:
+        with engine.begin() as conn:
+            _lock(conn)
+            if _applied_version(conn) >= version:
+                continue
+            upgrade(conn)
+            _record(conn, version, name)
+        applied.append(name)
+        print(f"✅ Миграция {version}: {name}")
+    return applied
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    print(f"✅ Версия схемы: {current_version()} ({', '.join(applied) if applied else 'без изменений'})")
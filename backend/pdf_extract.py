@@ -0,0 +1,129 @@
+# pdf_extract.py
+import asyncio
+import itertools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional
+
+from text_compact import PAGE_BREAK
+
+logger = logging.getLogger(__name__)
+
+
+class PDFExtractionError(Exception):
+    """Не удалось извлечь текст из PDF (файл повреждён или разбор слишком долгий)"""
+
+
+def iter_pdf_pages(path: str, max_pages: int) -> Iterator[str]:
+    """Текст PDF постранично: страницы разбираются лениво, по одной"""
+    from PyPDF2 import PdfReader
+    with open(path, "rb") as f:
+        reader = PdfReader(f)
+        for page in itertools.islice(reader.pages, max_pages):
+            yield page.extract_text() or ""
+
+
+def extract_pdf_text(path: str, max_pages: int, max_chars: int) -> str:
+    """Извлекает текст PDF, пока не заполнен бюджет символов (выполняется в дочернем процессе)"""
+    try:
+        pages = []
+        collected = 0
+        for text in iter_pdf_pages(path, max_pages):
+            if not text:
+                continue
+            pages.append(text)
+            collected += len(text) + 1
+            if collected > max_chars:
+                break
+        # Границы страниц сохраняем: по ним compact_text находит колонтитулы
+        return PAGE_BREAK.join(pages).strip()
+    except Exception as e:
+        # Ошибку не подменяем текстом: иначе все нечитаемые файлы попадут в GPT и в кэш как один документ
+        logger.error(f"PDF parse error: {e}")
+        raise PDFExtractionError("Не удалось прочитать PDF: файл повреждён или не является PDF")
+
+
+class PDFExtractor:
+    """Извлечение текста в пуле процессов: PyPDF2 не держит GIL event loop'а"""
+
+    def __init__(self, workers: int, timeout: float, max_pages: int, max_chars: int):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Задач в пуле не больше, чем процессов: таймаут отсчитывается от начала работы, а не от очереди
+        self._slots = asyncio.Semaphore(max(1, workers))
+        # Номер пула: меняется при перезапуске, по нему видно, что задачу убили из-за чужого документа
+        self._generation = 0
+        self.timeouts = 0
+        self.retried = 0
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: безопасно при запущенном event loop и потоках (в отличие от fork)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def extract(self, path: str) -> str:
+        """Текст PDF-файла по пути (в процесс передаётся путь, а не содержимое)"""
+        args = (path, self.max_pages, self.max_chars)
+        if self.workers <= 0:
+            # PDF_WORKERS=0: без пула процессов, в потоке (локальная разработка)
+            return await asyncio.to_thread(extract_pdf_text, *args)
+
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            for attempt in (1, 2):
+                generation = self._generation
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(self.pool, extract_pdf_text, *args),
+                        timeout=self.timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    logger.error(f"❌ Извлечение текста дольше {self.timeout} с — перезапускаем пул")
+                    self._kill_pool()
+                    raise PDFExtractionError("Документ слишком сложный для обработки")
+                except (BrokenProcessPool, asyncio.CancelledError):
+                    # Отмена задачи, которую ждём, — наша собственная отмена, а не перезапуск пула
+                    if asyncio.current_task().cancelling():
+                        raise
+                    if self._generation != generation and attempt == 1:
+                        # Пул перезапущен из-за другого документа — повторяем на новом
+                        self.retried += 1
+                        continue
+                    if self._generation == generation:
+                        self._kill_pool()
+                    raise PDFExtractionError("Обработчик PDF перезапущен, повторите попытку")
+
+    def _kill_pool(self) -> None:
+        """Останавливает зависшие процессы: ProcessPoolExecutor не умеет отменять запущенные задачи"""
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        self._generation += 1
+        for process in list(getattr(pool, "_processes", {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "timeout": self.timeout,
+            "max_pages": self.max_pages,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+        }
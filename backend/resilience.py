@@ -0,0 +1,165 @@
+# resilience.py
+import time
+import random
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GPTRequestError(Exception):
+    """Провайдер вернул ошибку"""
+
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"GPT error: {body}")
+        self.status_code = status_code
+        self.body = body
+
+
+class CircuitOpenError(Exception):
+    """Провайдер недоступен: запрос отклонён без обращения к нему"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число или HTTP-дата"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """closed -> open после N ошибок подряд -> half_open (один пробный запрос) -> closed"""
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info("✅ GPT снова доступен, circuit breaker закрыт")
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Пробный запрос завершился без вердикта о провайдере (4xx, ошибка до отправки, отмена)"""
+        if self.state == "half_open":
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                logger.error(f"⛔ GPT недоступен, circuit breaker открыт на {self.recovery_timeout} с")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        retry_in = None
+        if self.state == "open":
+            retry_in = round(max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at)), 1)
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "retry_in": retry_in,
+        }
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5,
+                 max_delay: float = 8, max_retry_after: float = 30):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """Пауза перед повтором (attempt с 1); None — повтор бессмысленен"""
+        if retry_after is not None:
+            return retry_after if retry_after <= self.max_retry_after else None
+        # Full jitter: случайная пауза до экспоненциального потолка
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+async def send_with_retries(
+    send: Callable[[], Awaitable[httpx.Response]],
+    breaker: CircuitBreaker,
+    policy: RetryPolicy,
+) -> httpx.Response:
+    """Отправляет запрос с повторами для временных ошибок; возвращает только ответ 200"""
+    attempt = 0
+    while True:
+        attempt += 1
+        if not breaker.allow():
+            raise CircuitOpenError("GPT временно недоступен, повторите попытку позже")
+        probe = breaker.state == "half_open"
+
+        retry_after = None
+        try:
+            response = await send()
+        except (httpx.TimeoutException, httpx.NetworkError) as e:
+            breaker.record_failure()
+            error: Exception = e
+        else:
+            if response.status_code == 200:
+                breaker.record_success()
+                return response
+            body = (await response.aread()).decode(errors="replace")
+            await response.aclose()
+            error = GPTRequestError(response.status_code, body)
+            if response.status_code not in RETRYABLE_STATUSES:
+                # Ошибка запроса (4xx), а не провайдера — breaker не трогаем
+                raise error
+            # 429 — наша квота, а не отказ провайдера
+            if response.status_code == 429:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        finally:
+            # Любой выход без record_* (4xx, исключение в send, отмена) освобождает пробный слот,
+            # иначе breaker навсегда остаётся в half_open
+            if probe:
+                breaker.release_probe()
+
+        delay = policy.delay(attempt, retry_after)
+        if attempt >= policy.max_attempts or delay is None:
+            raise error
+        logger.warning(f"🔁 GPT: {error}; повтор {attempt + 1}/{policy.max_attempts} через {delay:.1f} с")
+        await asyncio.sleep(delay)
@@ -0,0 +1,54 @@
+# tests/test_admission.py
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import FairLimiter  # noqa: E402
+
+
+async def hold(limiter: FairLimiter, user_id: str, release: asyncio.Event, started: list) -> None:
+    async with limiter.slot(user_id):
+        started.append(user_id)
+        await release.wait()
+
+
+def test_new_user_not_blocked_by_user_at_per_user_limit():
+    async def scenario():
+        limiter = FairLimiter(max_concurrent=4, max_per_user=1)
+        release = asyncio.Event()
+        started: list = []
+        # У A один активный вызов и два в очереди (упёрлись в max_per_user)
+        tasks = [asyncio.create_task(hold(limiter, "A", release, started)) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(hold(limiter, "B", release, started)))
+        await asyncio.sleep(0)
+        assert started == ["A", "B"]
+        assert limiter.active == 2
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started.count("A") == 3
+        assert limiter.active == 0 and limiter.stats()["queue_depth"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiters_served_round_robin():
+    async def scenario():
+        limiter = FairLimiter(max_concurrent=1)
+        release = asyncio.Event()
+        done = asyncio.Event()
+        done.set()
+        order: list = []
+        blocker = asyncio.create_task(hold(limiter, "X", release, order))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(hold(limiter, u, done, order)) for u in ("A", "A", "A", "B")]
+        await asyncio.sleep(0)
+        assert limiter.stats()["queue_depth"] == 4
+        release.set()
+        await asyncio.gather(blocker, *tasks)
+        # B не ждёт, пока пройдут все запросы A
+        assert order == ["X", "A", "B", "A", "A"]
+        assert limiter.active == 0 and limiter.stats()["queue_depth"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,19 @@
+# tests/test_chunking.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunking import split_into_chunks  # noqa: E402
+
+
+@pytest.mark.parametrize("text", [
+    "x" * 20000,
+    ("слово " * 4000),
+    "1. Предмет договора. " + ("Текст пункта без переносов. " * 900),
+])
+def test_chunks_never_exceed_max_chars(text):
+    chunks = split_into_chunks(text, 4500)
+    assert all(len(chunk) <= 4500 for chunk in chunks)
+    assert "".join(chunks) == text
@@ -0,0 +1,29 @@
+# tests/test_llm_json.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from llm_json import parse_number  # noqa: E402
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1,250,000.00", 1250000.0),
+    ("1.250.000 руб", 1250000.0),
+    ("USD 1,000", 1000.0),
+    ("5 млн", 5000000.0),
+    ("1 250 000,50 руб.", 1250000.5),
+    ("1 250 000", 1250000.0),
+    ("1250,50", 1250.5),
+    ("0,125", 0.125),
+    ("12%", 12.0),
+    ("-3,5", -3.5),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
+
+
+@pytest.mark.parametrize("text", ["12.5.2024", "1.250,000", "1 25 000", "нет суммы"])
+def test_ambiguous_or_missing_number_is_none(text):
+    assert parse_number(text) is None
@@ -0,0 +1,26 @@
+# tests/test_pdf_extract.py
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf_extract import PDFExtractor, PDFExtractionError, extract_pdf_text  # noqa: E402
+
+
+def test_corrupt_file_raises(tmp_path):
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"not a pdf at all")
+    with pytest.raises(PDFExtractionError):
+        extract_pdf_text(str(path), max_pages=10, max_chars=1000)
+
+
+def test_corrupt_upload_is_not_turned_into_text(tmp_path):
+    # Разные нечитаемые файлы не должны превращаться в одинаковый «текст документа»
+    extractor = PDFExtractor(workers=0, timeout=5, max_pages=10, max_chars=1000)
+    for i, content in enumerate((b"garbage one", b"\x00\x01\x02 garbage two")):
+        path = tmp_path / f"broken{i}.pdf"
+        path.write_bytes(content)
+        with pytest.raises(PDFExtractionError):
+            asyncio.run(extractor.extract(str(path)))
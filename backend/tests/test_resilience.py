@@ -0,0 +1,76 @@
+# tests/test_resilience.py
+import os
+import sys
+import asyncio
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from resilience import CircuitBreaker, CircuitOpenError, GPTRequestError, RetryPolicy, send_with_retries  # noqa: E402
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+    breaker.record_failure()
+    return breaker
+
+
+def respond(status: int):
+    async def send():
+        return httpx.Response(status, text="{}")
+    return send
+
+
+async def explode():
+    raise RuntimeError("IAM недоступен")
+
+
+async def hang():
+    await asyncio.sleep(10)
+
+
+@pytest.mark.parametrize("probe, expected", [
+    (respond(400), GPTRequestError),
+    (respond(401), GPTRequestError),
+    (explode, RuntimeError),
+])
+def test_probe_without_verdict_releases_breaker(probe, expected):
+    breaker = half_open_breaker()
+    policy = RetryPolicy(max_attempts=1)
+    with pytest.raises(expected):
+        asyncio.run(send_with_retries(probe, breaker, policy))
+    # Следующий запрос снова пробный и при успехе закрывает breaker
+    asyncio.run(send_with_retries(respond(200), breaker, policy))
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_releases_breaker():
+    breaker = half_open_breaker()
+    policy = RetryPolicy(max_attempts=1)
+
+    async def scenario():
+        task = asyncio.create_task(send_with_retries(hang, breaker, policy))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await send_with_retries(respond(200), breaker, policy)
+
+    asyncio.run(scenario())
+    assert breaker.state == "closed"
+
+
+def test_only_one_probe_in_flight():
+    breaker = half_open_breaker()
+    policy = RetryPolicy(max_attempts=1)
+
+    async def scenario():
+        task = asyncio.create_task(send_with_retries(hang, breaker, policy))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await send_with_retries(respond(200), breaker, policy)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(scenario())
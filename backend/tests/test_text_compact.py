@@ -0,0 +1,17 @@
+# tests/test_text_compact.py
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_compact import compact_text  # noqa: E402
+
+
+def test_syllable_break_is_joined():
+    assert compact_text("Настоящий дого-\nвор заключён").text == "Настоящий договор заключён"
+
+
+def test_real_hyphens_at_line_break_are_kept():
+    assert "2023-2024" in compact_text("Период 2023-\n2024 гг.").text
+    assert "Санкт-Петербург" in compact_text("г. Санкт-\nПетербург").text
+    assert "какой-либо" in compact_text("без какой-\nлибо оплаты").text
+    assert "кое-что" in compact_text("осталось кое-\nчто сделать").text
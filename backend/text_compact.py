@@ -0,0 +1,148 @@
+# text_compact.py
+import re
+from collections import Counter
+from typing import List, NamedTuple, Set, Tuple
+
+# Разделитель страниц в тексте, который возвращает извлечение PDF
+PAGE_BREAK = "\f"
+
+# Грубая оценка для YandexGPT: ~3 символа русского текста на токен
+CHARS_PER_TOKEN = 3
+
+_SIGNATURE_LINE = re.compile(r"[_\-.=…]{4,}")
+_HYPHEN_BREAK = re.compile(r"(\w+)-\n(\w+)")
+# Дефисные частицы: «какой-либо», «кое-что» — дефис в них настоящий, а не перенос
+_HYPHEN_PREFIXES = {"кое", "кой"}
+_HYPHEN_SUFFIXES = {"то", "либо", "нибудь", "ка", "таки", "де"}
+_INLINE_SPACES = re.compile(r"[ \t ]+")
+# Номер страницы с подписью («Стр. 3», «Page 3 of 10») — однозначен, убирается где угодно
+_PAGE_LABEL = re.compile(r"^(?:стр\.?|страница|page)\s*\d{1,4}\s*(?:(?:из|of|/)\s*\d{1,4})?$", re.IGNORECASE)
+# Голое число («3», «- 3 -», «3 из 10») — так же выглядят ячейки таблиц и перенесённые значения
+_BARE_PAGE_NUMBER = re.compile(r"^[-–—]?\s*(\d{1,4})\s*(?:(?:из|of|/)\s*\d{1,4})?\s*[-–—]?$", re.IGNORECASE)
+# Строка заканчивает мысль: точка, двоеточие, точка с запятой и т.п.
+_SENTENCE_END = re.compile(r"[.:;!?»\")]$")
+_LIST_START = re.compile(r"^(?:\d+(?:\.\d+)*\.?|[-•*—]|[а-яa-z]\))\s", re.IGNORECASE)
+
+
+class CompactedText(NamedTuple):
+    text: str
+    chars_before: int
+    chars_after: int
+
+    @property
+    def chars_saved(self) -> int:
+        return self.chars_before - self.chars_after
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.chars_saved // CHARS_PER_TOKEN
+
+    def stats(self) -> dict:
+        return {
+            "chars_before": self.chars_before,
+            "chars_after": self.chars_after,
+            "chars_saved": self.chars_saved,
+            "tokens_saved_estimate": self.tokens_saved,
+        }
+
+
+def _normalize_line(line: str) -> str:
+    return _INLINE_SPACES.sub(" ", line).strip()
+
+
+def _join_hyphen_break(match: re.Match) -> str:
+    """Перенос по слогам склеивается; даты, диапазоны и составные названия сохраняют дефис"""
+    left, right = match.group(1), match.group(2)
+    is_syllable_break = (
+        left[-1].isalpha() and left[-1].islower()
+        and right[0].isalpha() and right[0].islower()
+        and left.lower() not in _HYPHEN_PREFIXES
+        and right.lower() not in _HYPHEN_SUFFIXES
+    )
+    return f"{left}{right}" if is_syllable_break else f"{left}-{right}"
+
+
+def _repeated_lines(pages: List[List[str]]) -> set:
+    """Колонтитулы: строки, которые встречаются на большинстве страниц"""
+    if len(pages) < 3:
+        return set()
+    counts = Counter(line.lower() for page in pages for line in set(page) if line)
+    threshold = max(2, len(pages) // 2)
+    # Строки без букв (количества, суммы) не колонтитулы, даже если повторяются
+    return {
+        line for line, n in counts.items()
+        if n >= threshold and len(line) < 120 and any(ch.isalpha() for ch in line)
+    }
+
+
+def _page_number_lines(pages: List[List[str]], boilerplate: set) -> Set[Tuple[int, int]]:
+    """Позиции (страница, строка) номеров страниц
+
+    Голое число считается номером, только если стоит первой или последней строкой страницы
+    и вместе с такими же числами на других страницах растёт на 1 от страницы к странице.
+    """
+    found = set()
+    candidates = []
+    for i, page in enumerate(pages):
+        content = [j for j, line in enumerate(page) if line and line.lower() not in boilerplate]
+        for j in content:
+            if _PAGE_LABEL.match(page[j]):
+                found.add((i, j))
+        for j in {content[0], content[-1]} if content else ():
+            match = _BARE_PAGE_NUMBER.match(page[j])
+            if match:
+                candidates.append((i, j, int(match.group(1)) - i))
+    if not candidates:
+        return found
+    # Смещение нумерации (титульный лист без номера и т.п.), общее для большинства страниц
+    offset, support = Counter(c[2] for c in candidates).most_common(1)[0]
+    if support >= 2 or (len(pages) == 1 and offset == 1):
+        found.update((i, j) for i, j, o in candidates if o == offset)
+    return found
+
+
+def _join_broken_lines(lines: List[str]) -> List[str]:
+    """Склеивает строки, разорванные вёрсткой PDF посреди предложения"""
+    joined: List[str] = []
+    for line in lines:
+        if (
+            joined
+            and line
+            and joined[-1]
+            and not _SENTENCE_END.search(joined[-1])
+            and not _LIST_START.match(line)
+            and line[0].islower()
+        ):
+            joined[-1] = f"{joined[-1]} {line}"
+        else:
+            joined.append(line)
+    return joined
+
+
+def compact_text(text: str) -> CompactedText:
+    """Убирает из текста PDF колонтитулы, номера страниц, линии подписей и лишние пробелы"""
+    chars_before = len(text)
+    text = _HYPHEN_BREAK.sub(_join_hyphen_break, text)
+
+    pages = [
+        [_normalize_line(line) for line in page.splitlines()]
+        for page in text.split(PAGE_BREAK)
+    ]
+    boilerplate = _repeated_lines(pages)
+    page_numbers = _page_number_lines(pages, boilerplate)
+
+    lines: List[str] = []
+    for i, page in enumerate(pages):
+        for j, line in enumerate(page):
+            if (i, j) in page_numbers:
+                continue
+            line = _normalize_line(_SIGNATURE_LINE.sub(" ", line))
+            if line.lower() in boilerplate:
+                continue
+            # Пустые строки схлопываются в одну (граница абзаца)
+            if not line and (not lines or not lines[-1]):
+                continue
+            lines.append(line)
+
+    compacted = "\n".join(_join_broken_lines(lines)).strip()
+    return CompactedText(compacted, chars_before, len(compacted))
@@ -0,0 +1,165 @@
+# uploads.py
+import os
+import asyncio
+import hashlib
+import zipfile
+import tempfile
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+
+# Размер блока при копировании загрузки во временный файл
+CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledUpload:
+    """Загруженный файл на диске: путь, sha256 и размер считаются за один проход"""
+
+    def __init__(self, path: str, sha256: str, size: int, filename: str):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.filename = filename
+
+    def cleanup(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(413, f"Файл больше {max_bytes // (1024 * 1024)} MB")
+
+
+async def spool_upload(file: UploadFile, max_bytes: int, tmp_dir: Optional[str] = None) -> SpooledUpload:
+    """Копирует загрузку блоками во временный файл, не держа её целиком в памяти"""
+    digest = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="docubot-", suffix=".upload", dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return SpooledUpload(path, digest.hexdigest(), size, file.filename)
+
+
+def unpack_zip(
+    archive: SpooledUpload,
+    max_files: int,
+    max_file_bytes: int,
+    max_total_bytes: int,
+    max_ratio: int = 100,
+    tmp_dir: Optional[str] = None,
+) -> List[SpooledUpload]:
+    """PDF-файлы из ZIP-архива во временные файлы (синхронно — вызывать через to_thread)
+
+    Защита от zip-бомб: лимит числа файлов, размера каждого и суммы, степени сжатия;
+    заявленным в заголовках размерам не доверяем — считаем распакованные байты.
+    """
+    uploads: List[SpooledUpload] = []
+    total = 0
+    try:
+        with zipfile.ZipFile(archive.path) as zf:
+            entries = [
+                info for info in zf.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(".pdf")
+                and not os.path.basename(info.filename).startswith(".")
+            ]
+            if len(entries) > max_files:
+                raise HTTPException(400, f"В архиве больше {max_files} PDF-файлов")
+            for info in entries:
+                if info.flag_bits & 0x1:
+                    raise HTTPException(400, f"Файл в архиве зашифрован: {info.filename}")
+                if info.file_size > max_file_bytes:
+                    raise _too_large(max_file_bytes)
+                if info.compress_size and info.file_size / info.compress_size > max_ratio:
+                    raise HTTPException(400, f"Подозрительно сильно сжатый файл: {info.filename}")
+
+                digest = hashlib.sha256()
+                size = 0
+                fd, path = tempfile.mkstemp(prefix="docubot-", suffix=".upload", dir=tmp_dir)
+                uploads.append(SpooledUpload(path, "", 0, os.path.basename(info.filename)))
+                with os.fdopen(fd, "wb") as out, zf.open(info) as src:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                        total += len(chunk)
+                        if size > max_file_bytes:
+                            raise _too_large(max_file_bytes)
+                        if total > max_total_bytes:
+                            raise HTTPException(413, f"Архив распаковывается больше чем в {max_total_bytes // (1024 * 1024)} MB")
+                        digest.update(chunk)
+                        out.write(chunk)
+                uploads[-1].sha256 = digest.hexdigest()
+                uploads[-1].size = size
+    except zipfile.BadZipFile:
+        for upload in uploads:
+            upload.cleanup()
+        raise HTTPException(400, "Повреждённый ZIP-архив")
+    except BaseException:
+        for upload in uploads:
+            upload.cleanup()
+        raise
+    return uploads
+
+
+class UploadSizeLimitMiddleware:
+    """Отклоняет слишком большие тела запросов до того, как они будут прочитаны в память"""
+
+    def __init__(self, app, max_bytes: int, overrides: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        # path -> лимит (например, для пакетной загрузки)
+        self.overrides = overrides or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        limit = self.overrides.get(scope["path"], self.max_bytes)
+
+        # Content-Length известен заранее — отвечаем 413, не читая тело
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > limit:
+                    response = JSONResponse({"detail": _too_large(limit).detail}, status_code=413)
+                    return await response(scope, receive, send)
+                break
+
+        # Chunked-загрузка или неверный Content-Length — считаем байты по мере чтения
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise _too_large(limit)
+            return message
+
+        await self.app(scope, limited_receive, send)